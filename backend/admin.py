@@ -180,20 +180,27 @@ async def list_users(
     admin: dict = Depends(require_view_users)
 ):
     """List all users with their stats."""
+    # Deferred join: pick the page of users first, then count conversations
+    # and queries only for those users rather than for every user
     async with get_connection() as conn:
         if search:
             rows = await conn.fetch(
                 """
-                SELECT u.id, u.email, u.credits, u.created_at,
-                       COUNT(DISTINCT c.id) as conversation_count,
-                       COUNT(DISTINCT m.id) FILTER (WHERE m.role = 'assistant') as query_count
-                FROM users u
-                LEFT JOIN conversations c ON c.user_id = u.id
-                LEFT JOIN messages m ON m.conversation_id = c.id
-                WHERE LOWER(u.email) LIKE LOWER($1)
-                GROUP BY u.id
-                ORDER BY u.created_at DESC
-                LIMIT $2 OFFSET $3
+                WITH page AS (
+                    SELECT id, email, credits, created_at
+                    FROM users
+                    WHERE LOWER(email) LIKE LOWER($1)
+                    ORDER BY created_at DESC
+                    LIMIT $2 OFFSET $3
+                )
+                SELECT p.id, p.email, p.credits, p.created_at,
+                       (SELECT COUNT(*) FROM conversations c
+                        WHERE c.user_id = p.id) as conversation_count,
+                       (SELECT COUNT(*) FROM messages m
+                        JOIN conversations c ON c.id = m.conversation_id
+                        WHERE c.user_id = p.id AND m.role = 'assistant') as query_count
+                FROM page p
+                ORDER BY p.created_at DESC
                 """,
                 f"%{search}%",
                 limit,
@@ -202,15 +209,20 @@ async def list_users(
         else:
             rows = await conn.fetch(
                 """
-                SELECT u.id, u.email, u.credits, u.created_at,
-                       COUNT(DISTINCT c.id) as conversation_count,
-                       COUNT(DISTINCT m.id) FILTER (WHERE m.role = 'assistant') as query_count
-                FROM users u
-                LEFT JOIN conversations c ON c.user_id = u.id
-                LEFT JOIN messages m ON m.conversation_id = c.id
-                GROUP BY u.id
-                ORDER BY u.created_at DESC
-                LIMIT $1 OFFSET $2
+                WITH page AS (
+                    SELECT id, email, credits, created_at
+                    FROM users
+                    ORDER BY created_at DESC
+                    LIMIT $1 OFFSET $2
+                )
+                SELECT p.id, p.email, p.credits, p.created_at,
+                       (SELECT COUNT(*) FROM conversations c
+                        WHERE c.user_id = p.id) as conversation_count,
+                       (SELECT COUNT(*) FROM messages m
+                        JOIN conversations c ON c.id = m.conversation_id
+                        WHERE c.user_id = p.id AND m.role = 'assistant') as query_count
+                FROM page p
+                ORDER BY p.created_at DESC
                 """,
                 limit,
                 offset
@@ -242,15 +254,12 @@ async def get_user_detail(request: Request, user_id: str, admin: dict = Depends(
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
-        # Get user's conversations - only count user messages (queries)
+        # Get user's conversations - message_count only counts user messages (queries)
         conversations = await conn.fetch(
             """
-            SELECT c.id, c.title, c.created_at,
-                   COUNT(m.id) FILTER (WHERE m.role = 'user') as message_count
+            SELECT c.id, c.title, c.created_at, c.message_count
             FROM conversations c
-            LEFT JOIN messages m ON m.conversation_id = c.id
             WHERE c.user_id = $1
-            GROUP BY c.id
             ORDER BY c.created_at DESC
             LIMIT 20
             """,
@@ -333,6 +342,7 @@ async def adjust_user_credits(
             new_credits,
             user_id
         )
+    storage.invalidate_user_cache(user_id)
 
     # Log the action
     await storage.log_admin_action(
@@ -384,6 +394,7 @@ async def set_credits_by_email(
             credits,
             user["id"]
         )
+    storage.invalidate_user_cache(user["id"])
 
     # Log the action
     await storage.log_admin_action(
@@ -550,6 +561,12 @@ async def delete_user_by_email(
 
         await conn.execute("DELETE FROM users WHERE id = $1", user_id)
 
+    # Invalidate only once the deletes have committed, so a concurrent read
+    # can't re-cache the deleted data
+    for conv_id in conv_id_list:
+        storage.invalidate_conversation_cache(conv_id, messages_deleted=True)
+    storage.invalidate_user_cache(user_id)
+
     # Log the action
     await storage.log_admin_action(
         admin_id=admin_id,
@@ -736,7 +753,7 @@ async def list_recent_decisions(
                     user_msg.content as question,
                     user_msg.created_at as asked_at,
                     asst_msg.id as response_id,
-                    asst_msg.stage3 as chairman_response,
+                    asst_msg.stage3::text as chairman_response,
                     asst_msg.mode,
                     asst_msg.created_at as answered_at,
                     u.email as user_email,
@@ -776,7 +793,7 @@ async def list_recent_decisions(
                     user_msg.content as question,
                     user_msg.created_at as asked_at,
                     asst_msg.id as response_id,
-                    asst_msg.stage3 as chairman_response,
+                    asst_msg.stage3::text as chairman_response,
                     asst_msg.mode,
                     asst_msg.created_at as answered_at,
                     u.email as user_email,
@@ -1,38 +1,125 @@
 """Database connection and utilities for DecidePlease."""
 
+import asyncio
 import os
 import secrets
 import string
 import asyncpg
 import bcrypt
+import orjson
 from contextlib import asynccontextmanager
 from typing import Optional
 
+from .logging_config import get_logger
+
+logger = get_logger(__name__)
+
 # Database URL from environment (Render provides this automatically)
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Connection pool bounds. Keep DB_POOL_MAX_SIZE (times the number of app
+# instances) below the server's max_connections.
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "10"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "25"))
+
+# Prepared statements cached per pool connection. The storage layer issues
+# roughly a hundred distinct SQL strings, so the default leaves ample headroom.
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "1024"))
+
 # Superadmin configuration
 SUPERADMIN_EMAIL = "hello@decideplease.com"
 SUPERADMIN_PASSWORD = os.getenv("SUPERADMIN_PASSWORD")  # Optional: set via env var
 
-# Connection pool (initialized on first use)
+# Connection pool (created once, at startup by init_database or on first use)
 _pool: Optional[asyncpg.Pool] = None
+_pool_lock = asyncio.Lock()
+
+
+# Binary jsonb values are the JSON text behind a one-byte format version
+_JSONB_VERSION = b"\x01"
+
+
+def _encode_jsonb(value) -> bytes:
+    """Encode a Python value as a binary-format jsonb parameter."""
+    return _JSONB_VERSION + orjson.dumps(value)
+
+
+def _decode_jsonb(data: bytes):
+    """Decode a binary-format jsonb value."""
+    return orjson.loads(memoryview(data)[1:])
+
+
+async def _init_connection(conn: asyncpg.Connection):
+    """Configure a new pool connection before first use."""
+    # Exchange json/jsonb as Python objects instead of JSON strings, using
+    # the binary wire format so values go straight from orjson bytes to the
+    # server without a str round trip. json covers server-built results
+    # such as json_agg aggregates; its binary form is the plain JSON text.
+    await conn.set_type_codec(
+        "jsonb",
+        encoder=_encode_jsonb,
+        decoder=_decode_jsonb,
+        schema="pg_catalog",
+        format="binary",
+    )
+    await conn.set_type_codec(
+        "json",
+        encoder=orjson.dumps,
+        decoder=orjson.loads,
+        schema="pg_catalog",
+        format="binary",
+    )
 
 
 async def get_pool() -> asyncpg.Pool:
     """Get or create the database connection pool."""
     global _pool
-    if _pool is None:
+    if _pool is not None:
+        return _pool
+    # Concurrent first callers wait for a single pool instead of each
+    # creating (and leaking) their own
+    async with _pool_lock:
+        if _pool is not None:
+            return _pool
         if not DATABASE_URL:
             raise RuntimeError("DATABASE_URL environment variable not set")
         _pool = await asyncpg.create_pool(
             DATABASE_URL,
-            min_size=2,
-            max_size=10,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            # Keep prepared statements alive across acquires so the hot
+            # storage queries are parsed/planned once per connection
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+            # Never expire cached statements by age; the LRU size bounds them
+            max_cached_statement_lifetime=0,
+            # Recycle connections that sit idle for 5 minutes
+            max_inactive_connection_lifetime=300,
+            # Our queries are short OLTP lookups; JIT startup only adds latency
+            server_settings={"jit": "off"},
+            init=_init_connection,
+        )
+        print(
+            f"[DATABASE] Connection pool ready (min_size={DB_POOL_MIN_SIZE}, "
+            f"max_size={DB_POOL_MAX_SIZE}, statement_cache_size={DB_STATEMENT_CACHE_SIZE})"
         )
     return _pool
 
 
+def get_pool_stats() -> Optional[dict]:
+    """Return current connection pool usage, or None if no pool exists yet."""
+    if _pool is None:
+        return None
+    size = _pool.get_size()
+    idle = _pool.get_idle_size()
+    return {
+        "size": size,
+        "idle": idle,
+        "in_use": size - idle,
+        "min_size": _pool.get_min_size(),
+        "max_size": _pool.get_max_size(),
+    }
+
+
 async def close_pool():
     """Close the database connection pool."""
     global _pool
@@ -42,8 +129,18 @@ async def close_pool():
 
 
 @asynccontextmanager
-async def get_connection():
-    """Get a database connection from the pool."""
+async def get_connection(conn: Optional[asyncpg.Connection] = None):
+    """
+    Get a database connection from the pool.
+
+    Args:
+        conn: An already-acquired connection to reuse. When given it is
+            yielded as-is and left for the caller to release, so several
+            storage calls can share one pool acquisition.
+    """
+    if conn is not None:
+        yield conn
+        return
     pool = await get_pool()
     async with pool.acquire() as conn:
         yield conn
@@ -138,6 +235,71 @@ async def init_database():
         except Exception:
             pass  # Columns may already exist
 
+        # Stage payloads and context summaries are large model outputs that
+        # always get TOASTed. LZ4 compresses/decompresses them much faster than
+        # the default pglz. New values use it immediately; existing rows keep
+        # pglz until rewritten.
+        try:
+            for column in ("stage1", "stage1_5", "stage2", "stage3", "context_summary"):
+                await conn.execute(
+                    f"ALTER TABLE messages ALTER COLUMN {column} SET COMPRESSION lz4"
+                )
+        except Exception:
+            pass  # Requires PostgreSQL 14+ built with lz4
+
+        # Denormalized count of user messages per conversation, kept current by
+        # a trigger so conversation lists don't aggregate over messages.
+        # The column starts NULL so the trigger (NULL + 1 = NULL) and the
+        # backfill can't double count rows written while this runs.
+        await conn.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS message_count INTEGER")
+        # Install the function and trigger atomically and only create the
+        # trigger when missing: dropping and recreating it on every startup
+        # would miss rows other instances write in between, and the NULL-only
+        # backfill would never correct that drift. The table lock serializes
+        # concurrent startups so only one of them creates the trigger.
+        async with conn.transaction():
+            await conn.execute("LOCK TABLE messages IN SHARE ROW EXCLUSIVE MODE")
+            await conn.execute("""
+                CREATE OR REPLACE FUNCTION update_conversation_message_count()
+                RETURNS TRIGGER AS $$
+                BEGIN
+                    IF TG_OP = 'INSERT' AND NEW.role = 'user' THEN
+                        UPDATE conversations SET message_count = message_count + 1
+                        WHERE id = NEW.conversation_id;
+                    ELSIF TG_OP = 'DELETE' AND OLD.role = 'user' THEN
+                        UPDATE conversations SET message_count = message_count - 1
+                        WHERE id = OLD.conversation_id;
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+            """)
+            await conn.execute("""
+                DO $$
+                BEGIN
+                    IF NOT EXISTS (
+                        SELECT 1 FROM pg_trigger
+                        WHERE tgname = 'trg_messages_count'
+                          AND tgrelid = 'messages'::regclass
+                    ) THEN
+                        CREATE TRIGGER trg_messages_count
+                        AFTER INSERT OR DELETE ON messages
+                        FOR EACH ROW
+                        EXECUTE FUNCTION update_conversation_message_count();
+                    END IF;
+                END
+                $$
+            """)
+            await conn.execute("ALTER TABLE conversations ALTER COLUMN message_count SET DEFAULT 0")
+        await conn.execute("""
+            UPDATE conversations c
+            SET message_count = (
+                SELECT COUNT(*) FROM messages m
+                WHERE m.conversation_id = c.id AND m.role = 'user'
+            )
+            WHERE c.message_count IS NULL
+        """)
+
         # Create payments table for tracking Stripe payments
         await conn.execute("""
             CREATE TABLE IF NOT EXISTS payments (
@@ -153,13 +315,36 @@ async def init_database():
         """)
 
         # Create indexes for common queries
+        # Matches the list_conversations sort key (with id as tiebreaker) so
+        # each page is an index range scan. Its user_id prefix also serves
+        # plain user_id lookups, so no separate user_id index is kept.
+        await conn.execute("DROP INDEX IF EXISTS idx_conversations_user_sort")
+        await conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_conversations_user_sort_id
+            ON conversations(user_id, (COALESCE(updated_at, created_at)) DESC, id DESC)
+        """)
+        await conn.execute("DROP INDEX IF EXISTS idx_conversations_user_id")
+        # Conversation loads filter by conversation and read in created_at
+        # order; also serves every other conversation_id lookup
+        await conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_messages_conversation_created
+            ON messages(conversation_id, created_at)
+        """)
+        await conn.execute("DROP INDEX IF EXISTS idx_messages_conversation_id")
+        # Rerun revision lookups and next-revision MAX; most messages have
+        # no parent
         await conn.execute("""
-            CREATE INDEX IF NOT EXISTS idx_conversations_user_id
-            ON conversations(user_id)
+            CREATE INDEX IF NOT EXISTS idx_messages_parent_revision
+            ON messages(parent_message_id, revision_number DESC)
+            WHERE parent_message_id IS NOT NULL
         """)
+        await conn.execute("DROP INDEX IF EXISTS idx_messages_parent_message_id")
+        # Latest completed assistant message per conversation (follow-up
+        # context, previous decision, rerun source)
         await conn.execute("""
-            CREATE INDEX IF NOT EXISTS idx_messages_conversation_id
-            ON messages(conversation_id)
+            CREATE INDEX IF NOT EXISTS idx_messages_latest_assistant
+            ON messages(conversation_id, created_at DESC)
+            WHERE role = 'assistant' AND stage3 IS NOT NULL
         """)
         await conn.execute("""
             CREATE INDEX IF NOT EXISTS idx_payments_user_id
@@ -174,10 +359,44 @@ async def init_database():
             ON users(created_at)
         """)
         # Additional indexes for production performance
-        await conn.execute("""
-            CREATE INDEX IF NOT EXISTS idx_users_email
-            ON users(email)
-        """)
+        # Email lookups match case-insensitively via LOWER(email), which
+        # this index serves while also enforcing one account per address
+        try:
+            await conn.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS users_email_lower_key
+                ON users (LOWER(email))
+            """)
+            # Drop the fallback left by earlier startups once duplicates are
+            # resolved, so LOWER(email) isn't indexed twice
+            await conn.execute("DROP INDEX IF EXISTS idx_users_email_lower")
+        except asyncpg.UniqueViolationError:
+            # Legacy rows differ only by case; keep lookups indexed until the
+            # duplicates are resolved and the unique index can be built.
+            # Report the duplicates only when first falling back.
+            has_fallback = await conn.fetchval(
+                "SELECT to_regclass('idx_users_email_lower') IS NOT NULL"
+            )
+            if not has_fallback:
+                duplicates = await conn.fetch("""
+                    SELECT LOWER(email) as email,
+                           array_agg(id ORDER BY created_at) as user_ids
+                    FROM users
+                    GROUP BY LOWER(email)
+                    HAVING COUNT(*) > 1
+                """)
+                logger.warning(
+                    "users_email_case_duplicates",
+                    message=(
+                        "Unique LOWER(email) index not created; merge or rename "
+                        "these accounts so it can be built on a later startup"
+                    ),
+                    duplicates={row["email"]: row["user_ids"] for row in duplicates},
+                )
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_users_email_lower
+                ON users (LOWER(email))
+            """)
+        await conn.execute("DROP INDEX IF EXISTS idx_users_email")
         await conn.execute("""
             CREATE INDEX IF NOT EXISTS idx_users_role
             ON users(role)
@@ -244,14 +463,15 @@ async def init_database():
                 created_at TIMESTAMP DEFAULT NOW()
             )
         """)
+        # Token lookups use the index behind the UNIQUE constraint
+        await conn.execute("DROP INDEX IF EXISTS idx_magic_link_tokens_token")
+        # Pending-link checks only look at unused tokens, newest first
         await conn.execute("""
-            CREATE INDEX IF NOT EXISTS idx_magic_link_tokens_token
-            ON magic_link_tokens(token)
-        """)
-        await conn.execute("""
-            CREATE INDEX IF NOT EXISTS idx_magic_link_tokens_email
-            ON magic_link_tokens(email)
+            CREATE INDEX IF NOT EXISTS idx_magic_link_tokens_email_pending
+            ON magic_link_tokens(email, created_at DESC)
+            WHERE used_at IS NULL
         """)
+        await conn.execute("DROP INDEX IF EXISTS idx_magic_link_tokens_email")
         await conn.execute("""
             CREATE INDEX IF NOT EXISTS idx_magic_link_tokens_expires_at
             ON magic_link_tokens(expires_at)
@@ -367,25 +587,21 @@ async def migrate_credits_to_quotas(conn):
 
     print(f"[MIGRATION] Migrating {len(users_to_migrate)} users from credits to quotas...")
 
-    for user in users_to_migrate:
-        user_id = user["id"]
-        credits = user["credits"]
-
-        # Create admin-granted decisions
-        grant_id = str(uuid.uuid4())
-        await conn.execute(
-            """
-            INSERT INTO admin_granted_decisions
-                (id, user_id, standard_decisions, granted_by, granted_by_email,
-                 notes, expires_at, granted_at)
-            VALUES ($1, $2, $3, 'SYSTEM', 'migration@decideplease.com',
-                    'MIGRATION: Legacy credits converted', NULL, NOW())
-            ON CONFLICT DO NOTHING
-            """,
-            grant_id,
-            user_id,
-            credits
-        )
+    # Create admin-granted decisions for every user in one pipelined batch
+    await conn.executemany(
+        """
+        INSERT INTO admin_granted_decisions
+            (id, user_id, standard_decisions, granted_by, granted_by_email,
+             notes, expires_at, granted_at)
+        VALUES ($1, $2, $3, 'SYSTEM', 'migration@decideplease.com',
+                'MIGRATION: Legacy credits converted', NULL, NOW())
+        ON CONFLICT DO NOTHING
+        """,
+        [
+            (str(uuid.uuid4()), user["id"], user["credits"])
+            for user in users_to_migrate
+        ]
+    )
 
     print(f"[MIGRATION] Successfully migrated {len(users_to_migrate)} users")
 
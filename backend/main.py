@@ -4,12 +4,12 @@ import os
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Depends, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, ORJSONResponse
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 import uuid
-import json
 import asyncio
+import orjson
 from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 from .rate_limit import limiter
@@ -45,7 +45,7 @@ from .storage_pg import (
     record_overage_charge,
     record_payperuse_charge,
 )
-from .database import init_database, close_pool, get_connection
+from .database import init_database, close_pool, get_connection, get_pool_stats
 from .auth_custom import (
     get_current_user,
     hash_password,
@@ -186,7 +186,13 @@ async def lifespan(app: FastAPI):
     logger.info("application_stopped")
 
 
-app = FastAPI(title="DecidePlease API", lifespan=lifespan)
+# orjson encodes the large stage payloads in conversation responses
+# several times faster than the stdlib encoder
+app = FastAPI(
+    title="DecidePlease API",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 
 # Rate limiting configuration (imported from rate_limit module)
@@ -347,7 +353,10 @@ async def health_check():
     try:
         async with get_connection() as conn:
             await conn.fetchval("SELECT 1")
-        health_status["checks"]["database"] = {"status": "healthy"}
+        health_status["checks"]["database"] = {
+            "status": "healthy",
+            "pool": get_pool_stats()
+        }
     except Exception as e:
         health_status["status"] = "unhealthy"
         health_status["checks"]["database"] = {
@@ -818,7 +827,12 @@ async def google_oauth_callback(request: Request, callback: GoogleCallbackReques
     # Check if user exists
     async with get_connection() as conn:
         user = await conn.fetchrow(
-            "SELECT id, email, role, credits, auth_provider, oauth_id FROM users WHERE email = $1",
+            """
+            SELECT id, email, role, credits, auth_provider, oauth_id
+            FROM users WHERE LOWER(email) = LOWER($1)
+            ORDER BY email = LOWER($1) DESC, created_at
+            LIMIT 1
+            """,
             email
         )
 
@@ -830,6 +844,7 @@ async def google_oauth_callback(request: Request, callback: GoogleCallbackReques
                     "UPDATE users SET oauth_id = $1, auth_provider = 'google', email_verified = TRUE WHERE id = $2",
                     google_id, user["id"]
                 )
+                storage.invalidate_user_cache(user["id"])
                 logger.info("google_oauth_linked", user_id=user["id"], email=email)
 
             user_id = user["id"]
@@ -1003,6 +1018,7 @@ async def update_email(request: UpdateEmailRequest, user: dict = Depends(get_cur
             request.new_email,
             user["user_id"]
         )
+    storage.invalidate_user_cache(user["user_id"])
 
     return {"message": "Email updated successfully"}
 
@@ -1081,6 +1097,12 @@ async def delete_account(user: dict = Depends(get_current_user)):
 
         await conn.execute("DELETE FROM users WHERE id = $1", user_id)
 
+    # Invalidate only once the deletes have committed, so a concurrent read
+    # can't re-cache the deleted data
+    for conv_id in conv_id_list:
+        storage.invalidate_conversation_cache(conv_id, messages_deleted=True)
+    storage.invalidate_user_cache(user_id)
+
     return {"message": "Account deleted successfully"}
 
 
@@ -1109,21 +1131,29 @@ async def get_user_info(user: dict = Depends(get_current_user)):
 async def list_conversations(
     user: dict = Depends(get_current_user),
     limit: int = 50,
-    offset: int = 0
+    offset: int = 0,
+    cursor: Optional[str] = None
 ):
     """
     List conversations for the current user with pagination.
 
     Query params:
     - limit: Max conversations to return (default 50, max 100)
-    - offset: Skip this many conversations (for pagination)
+    - offset: Skip this many conversations (legacy pagination)
+    - cursor: next_cursor from the previous page (preferred over offset)
 
     Returns:
     - conversations: List of conversation metadata
-    - total: Total number of conversations
+    - total: Total number of conversations (null when paging by cursor)
     - has_more: Whether more conversations exist
+    - next_cursor: Cursor for the next page, or null on the last page
     """
-    return await storage.list_conversations(user["user_id"], limit=limit, offset=offset)
+    try:
+        return await storage.list_conversations(
+            user["user_id"], limit=limit, offset=offset, cursor=cursor
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
 
 
 @app.post("/api/conversations", response_model=Conversation)
@@ -1177,7 +1207,7 @@ async def update_conversation(
 ):
     """Update conversation metadata (title)."""
     # Verify ownership by fetching the conversation
-    conversation = await storage.get_conversation(conversation_id, user["user_id"])
+    conversation = await storage.get_conversation_metadata(conversation_id, user["user_id"])
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
@@ -1214,7 +1244,7 @@ async def send_message(
         )
 
     # Check if conversation exists and belongs to user
-    conversation = await storage.get_conversation(conversation_id, user["user_id"])
+    conversation = await storage.get_conversation_metadata(conversation_id, user["user_id"])
     if conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
@@ -1237,7 +1267,7 @@ async def send_message(
             )
 
     # Check if this is the first message
-    is_first_message = len(conversation["messages"]) == 0
+    is_first_message = conversation["message_count"] == 0
 
     # Add user message
     await storage.add_user_message(conversation_id, msg_request.content)
@@ -1276,6 +1306,12 @@ _active_tasks: Dict[str, asyncio.Task] = {}
 _active_status: Dict[str, str] = {}
 
 
+def _sse_event(event: Dict[str, Any]) -> bytes:
+    """Encode an event as a server-sent events data frame."""
+    # Stage events carry full model outputs; orjson encodes them straight to bytes
+    return b"data: " + orjson.dumps(event, option=orjson.OPT_NON_STR_KEYS) + b"\n\n"
+
+
 async def _heartbeat_task(queue: asyncio.Queue, operation: str, interval: int = 2):
     """
     Send periodic heartbeat events during long-running operations.
@@ -1535,66 +1571,73 @@ Respond to the new input above. If it's new information that affects the decisio
             'response': accumulated_content
         }
 
-        # ATOMIC SAVE: Save ALL stages in a single database transaction
-        # This ensures we never have partial/incomplete messages if interrupted
-        message_id = await storage.add_assistant_message_complete(
-            conversation_id=conversation_id,
-            stage1=stage1_results,
-            stage1_5=stage1_5_results if stage1_5_results else None,
-            stage2=stage2_results,
-            stage3=stage3_result,
-            mode=mode,
-            is_rerun=is_rerun,
-            rerun_input=rerun_input,
-            parent_message_id=parent_message_id
-        )
+        # Post-run bookkeeping shares pool connections instead of acquiring
+        # one per storage call. The connection is not held while waiting on
+        # the title generation task.
+        async with get_connection() as conn:
+            # ATOMIC SAVE: Save ALL stages in a single database transaction
+            # This ensures we never have partial/incomplete messages if interrupted
+            message_id = await storage.add_assistant_message_complete(
+                conversation_id=conversation_id,
+                stage1=stage1_results,
+                stage1_5=stage1_5_results if stage1_5_results else None,
+                stage2=stage2_results,
+                stage3=stage3_result,
+                mode=mode,
+                is_rerun=is_rerun,
+                rerun_input=rerun_input,
+                parent_message_id=parent_message_id,
+                conn=conn
+            )
 
-        await event_queue.put({
-            'type': 'stage3_complete',
-            'data': stage3_result,
-            'metadata': {
-                'label_to_model': label_to_model,
-                'aggregate_rankings': aggregate_rankings,
-                'mode': mode,
-                'enable_peer_review': enable_peer_review,
-                'enable_cross_review': enable_cross_review,
-                'has_stage1_5': bool(stage1_5_results)
-            }
-        })
+            await event_queue.put({
+                'type': 'stage3_complete',
+                'data': stage3_result,
+                'metadata': {
+                    'label_to_model': label_to_model,
+                    'aggregate_rankings': aggregate_rankings,
+                    'mode': mode,
+                    'enable_peer_review': enable_peer_review,
+                    'enable_cross_review': enable_cross_review,
+                    'has_stage1_5': bool(stage1_5_results)
+                }
+            })
 
-        # Save context summary for future follow-ups
-        try:
-            context_summary = build_context_summary(
-                original_question=content,
-                stage1_results=stage1_results,
-                stage2_results=stage2_results,
-                stage3_result=stage3_result,
-                aggregate_rankings=aggregate_rankings,
-                stage1_5_results=stage1_5_results if stage1_5_results else None
-            )
-            await storage.save_context_summary(message_id, context_summary)
-            logger.info("context_summary_saved",
-                conversation_id=conversation_id,
-                message_id=message_id,
-                original_question_len=len(content))
-        except Exception as ctx_err:
-            # Log but don't fail the request if context saving fails
-            logger.error("context_summary_save_failed",
-                conversation_id=conversation_id,
-                message_id=message_id,
-                error=str(ctx_err),
-                exc_info=True)
+            # Save context summary for future follow-ups
+            try:
+                context_summary = build_context_summary(
+                    original_question=content,
+                    stage1_results=stage1_results,
+                    stage2_results=stage2_results,
+                    stage3_result=stage3_result,
+                    aggregate_rankings=aggregate_rankings,
+                    stage1_5_results=stage1_5_results if stage1_5_results else None
+                )
+                await storage.save_context_summary(message_id, context_summary, conn=conn)
+                logger.info("context_summary_saved",
+                    conversation_id=conversation_id,
+                    message_id=message_id,
+                    original_question_len=len(content))
+            except Exception as ctx_err:
+                # Log but don't fail the request if context saving fails
+                logger.error("context_summary_save_failed",
+                    conversation_id=conversation_id,
+                    message_id=message_id,
+                    error=str(ctx_err),
+                    exc_info=True)
 
         # Wait for title generation
-        if title_task:
-            title = await title_task
-            await storage.update_conversation_title(conversation_id, title)
-            await event_queue.put({'type': 'title_complete', 'data': {'title': title}})
-
-        # Get final quotas
-        remaining_quotas = await storage.get_user_quotas(user_id)
-        # Also get legacy credits for backward compatibility
-        remaining_credits = await storage.get_user_credits(user_id)
+        title = await title_task if title_task else None
+
+        async with get_connection() as conn:
+            if title_task:
+                await storage.update_conversation_title(conversation_id, title, conn=conn)
+                await event_queue.put({'type': 'title_complete', 'data': {'title': title}})
+
+            # Get final quotas
+            remaining_quotas = await storage.get_user_quotas(user_id, conn=conn)
+            # Also get legacy credits for backward compatibility
+            remaining_credits = await storage.get_user_credits(user_id, conn=conn)
         await event_queue.put({
             'type': 'complete',
             'credits': remaining_credits,  # Legacy: kept for backward compatibility
@@ -1677,7 +1720,7 @@ async def send_message_stream(
         credit_cost += FILE_UPLOAD_CREDIT_COST
 
     # Check if conversation exists and belongs to user
-    conversation = await storage.get_conversation(conversation_id, user["user_id"])
+    conversation = await storage.get_conversation_metadata(conversation_id, user["user_id"])
     if conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
@@ -1711,7 +1754,7 @@ async def send_message_stream(
             )
 
     # Check if this is the first message
-    is_first_message = len(conversation["messages"]) == 0
+    is_first_message = conversation["message_count"] == 0
 
     # Create event queue for communication between background task and SSE
     event_queue: asyncio.Queue = asyncio.Queue()
@@ -1737,7 +1780,7 @@ async def send_message_stream(
                 if event is None:
                     # Processing complete
                     break
-                yield f"data: {json.dumps(event)}\n\n"
+                yield _sse_event(event)
         except asyncio.CancelledError:
             # Client disconnected, but background task continues
             pass
@@ -1772,7 +1815,7 @@ async def get_conversation_status(
     when processing fails silently. Returns orphaned=True so client can retry.
     """
     # Verify ownership
-    conversation = await storage.get_conversation(conversation_id, user["user_id"])
+    conversation = await storage.get_conversation_metadata(conversation_id, user["user_id"])
     if conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
@@ -1850,7 +1893,7 @@ async def cancel_processing(
     Credits are refunded if cancellation is successful.
     """
     # Verify ownership
-    conversation = await storage.get_conversation(conversation_id, user["user_id"])
+    conversation = await storage.get_conversation_metadata(conversation_id, user["user_id"])
     if conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
@@ -1890,7 +1933,7 @@ async def delete_message(
     Only allows deletion of user messages, not assistant messages.
     """
     # Verify ownership
-    conversation = await storage.get_conversation(conversation_id, user["user_id"])
+    conversation = await storage.get_conversation_metadata(conversation_id, user["user_id"])
     if conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
@@ -1921,7 +1964,7 @@ async def retry_message(
     message endpoint that uses the existing message content.
     """
     # Verify ownership
-    conversation = await storage.get_conversation(conversation_id, user["user_id"])
+    conversation = await storage.get_conversation_metadata(conversation_id, user["user_id"])
     if conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
@@ -1984,17 +2027,20 @@ async def rerun_decision(
     credit_cost = mode_config['credit_cost']
 
     # Check if conversation exists and belongs to user
-    conversation = await storage.get_conversation(conversation_id, user["user_id"])
+    conversation = await storage.get_conversation_metadata(conversation_id, user["user_id"])
     if conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
-    # Get the original user message (the decision question)
-    original_question = await storage.get_original_user_message(conversation_id)
+    # Load the original user message (the decision question) and the latest
+    # assistant message concurrently, each on its own pool connection
+    original_question, latest_message = await asyncio.gather(
+        storage.get_original_user_message(conversation_id),
+        storage.get_latest_assistant_message(conversation_id),
+    )
+
     if not original_question:
         raise HTTPException(status_code=400, detail="No original decision found to rerun")
 
-    # Get the latest assistant message for context
-    latest_message = await storage.get_latest_assistant_message(conversation_id)
     if not latest_message:
         raise HTTPException(status_code=400, detail="No previous decision result found")
 
@@ -2047,7 +2093,7 @@ async def rerun_decision(
                 event = await event_queue.get()
                 if event is None:
                     break
-                yield f"data: {json.dumps(event)}\n\n"
+                yield _sse_event(event)
         except asyncio.CancelledError:
             pass
 
@@ -2074,7 +2120,7 @@ async def get_revisions(
     Get all revisions for a specific decision message.
     """
     # Verify conversation ownership
-    conversation = await storage.get_conversation(conversation_id, user["user_id"])
+    conversation = await storage.get_conversation_metadata(conversation_id, user["user_id"])
     if conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
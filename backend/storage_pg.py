@@ -1,27 +1,97 @@
 """Postgres-based storage for conversations."""
 
-import json
+import base64
+import logging
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from uuid import UUID
 
+import asyncpg
+import orjson
+
+from .cache import TTLCache
 from .database import get_connection
 from .config import RUN_MODES
 from .logging_config import get_logger
 
 logger = get_logger(__name__)
 
+# Recently loaded conversations, keyed by canonical conversation ID and
+# stored serialized so every hit returns a fresh, independently mutable dict.
+# Every storage function that writes messages or conversations invalidates
+# its entry.
+_conversation_cache = TTLCache(maxsize=512, ttl=30)
 
-def parse_json_field(value):
-    """Parse a JSON field that might be a string or already parsed."""
-    if value is None:
-        return None
-    if isinstance(value, str):
-        try:
-            return json.loads(value)
-        except json.JSONDecodeError:
-            return value
-    return value
+# First user message (the decision question) of recent conversations, keyed
+# by conversation ID. New messages never change it, so only deleting
+# messages invalidates an entry.
+_original_message_cache = TTLCache(maxsize=2048, ttl=300)
+
+# Extracted stage3 response text for follow-ups, keyed by
+# ("conversation", conversation_id) for a conversation's latest decision and
+# ("message", message_id) for a specific one. Only the text is kept, not the
+# whole stage3 payload.
+_stage3_response_cache = TTLCache(maxsize=4096, ttl=300)
+
+# Recently loaded user records and credit balances, keyed by user ID. Read on
+# nearly every authenticated request; every write to a user row invalidates.
+_user_cache = TTLCache(maxsize=2048, ttl=5)
+_user_credits_cache = TTLCache(maxsize=2048, ttl=5)
+
+# Bumped on every conversation invalidation. Readers note it before querying
+# and only cache their result if it is unchanged afterwards, so a snapshot
+# read before a write committed can't be re-cached after its invalidation.
+_conversation_generation = 0
+
+
+def _conversation_key(conversation_id: Any) -> str:
+    """Return the canonical cache key for a conversation ID."""
+    try:
+        return str(UUID(str(conversation_id)))
+    except ValueError:
+        # Not a UUID; the query will reject it, so any stable key will do
+        return str(conversation_id).lower()
+
+
+def invalidate_conversation_cache(
+    conversation_id: Optional[str] = None,
+    messages_deleted: bool = False
+) -> None:
+    """
+    Drop a cached conversation so the next read goes to the database.
+
+    Args:
+        conversation_id: Conversation to invalidate, or None to clear all
+        messages_deleted: Whether messages were removed, which may change
+            the conversation's original user message
+    """
+    global _conversation_generation
+    _conversation_generation += 1
+
+    if conversation_id is None:
+        _conversation_cache.clear()
+        _original_message_cache.clear()
+        _stage3_response_cache.clear()
+    else:
+        cache_key = _conversation_key(conversation_id)
+        _conversation_cache.pop(cache_key)
+        _stage3_response_cache.pop(("conversation", cache_key))
+        if messages_deleted:
+            _original_message_cache.pop(cache_key)
+
+
+def invalidate_user_cache(user_id: str) -> None:
+    """
+    Drop a user's cached record and credit balance.
+
+    Must be called after any write to the users row, including direct SQL
+    outside this module.
+
+    Args:
+        user_id: User whose cached data is stale
+    """
+    _user_cache.pop(user_id)
+    _user_credits_cache.pop(user_id)
 
 
 async def cleanup_incomplete_messages() -> int:
@@ -47,6 +117,7 @@ async def cleanup_incomplete_messages() -> int:
         # Parse the result to get count (format: "DELETE N")
         count = int(result.split()[-1]) if result else 0
         if count > 0:
+            invalidate_conversation_cache()
             logger.warning("cleanup_incomplete_messages", deleted_count=count)
         return count
 
@@ -63,19 +134,22 @@ async def create_conversation(conversation_id: str, user_id: str) -> Dict[str, A
         New conversation dict
     """
     async with get_connection() as conn:
-        await conn.execute(
+        # created_at comes from the column default; report the timestamp the
+        # database actually stored
+        row = await conn.fetchrow(
             """
-            INSERT INTO conversations (id, user_id, title, created_at)
-            VALUES ($1, $2, $3, NOW())
+            INSERT INTO conversations (id, user_id, title)
+            VALUES ($1, $2, $3)
+            RETURNING created_at
             """,
-            UUID(conversation_id),
+            conversation_id,
             user_id,
             "New Conversation"
         )
 
         return {
             "id": conversation_id,
-            "created_at": datetime.utcnow().isoformat(),
+            "created_at": row["created_at"].isoformat(),
             "title": "New Conversation",
             "messages": []
         }
@@ -90,109 +164,227 @@ async def get_conversation(conversation_id: str, user_id: str) -> Optional[Dict[
         user_id: The Clerk user ID (for ownership check)
 
     Returns:
-        Conversation dict or None if not found
+        Conversation dict or None if not found. Each call returns its own
+        copy, so callers may mutate it freely.
     """
+    cache_key = _conversation_key(conversation_id)
+    cached = _conversation_cache.get(cache_key)
+    if cached is not None and cached[0] == user_id:
+        return orjson.loads(cached[1])
+
+    generation = _conversation_generation
     async with get_connection() as conn:
-        # Get conversation metadata
+        # Load metadata and all messages in one round trip. Messages are
+        # shaped for the API in SQL so the decoded aggregate is used as-is:
+        # user messages carry their content, assistant messages their stages,
+        # and assistant messages with no stage data at all (orphaned from
+        # interrupted processing) are skipped.
         row = await conn.fetchrow(
             """
-            SELECT id, title, created_at
-            FROM conversations
-            WHERE id = $1 AND user_id = $2
+            SELECT c.id, c.title, c.created_at,
+                   COALESCE(
+                       json_agg(
+                           CASE WHEN m.role = 'user' THEN
+                               json_build_object(
+                                   'id', m.id,
+                                   'role', 'user',
+                                   'content', m.content
+                               )
+                           ELSE
+                               json_build_object(
+                                   'id', m.id,
+                                   'role', 'assistant',
+                                   'stage1', m.stage1,
+                                   'stage2', m.stage2,
+                                   'stage3', m.stage3
+                               )
+                           END
+                           ORDER BY m.created_at ASC
+                       ) FILTER (
+                           WHERE m.role = 'user'
+                              OR m.stage1 IS NOT NULL
+                              OR m.stage2 IS NOT NULL
+                              OR m.stage3 IS NOT NULL
+                       ),
+                       '[]'
+                   ) as messages
+            FROM conversations c
+            LEFT JOIN messages m ON m.conversation_id = c.id
+            WHERE c.id = $1 AND c.user_id = $2
+            GROUP BY c.id
             """,
-            UUID(conversation_id),
+            conversation_id,
             user_id
         )
 
         if row is None:
             return None
 
-        # Get all messages for this conversation
-        messages = await conn.fetch(
+        conversation = {
+            "id": str(row["id"]),
+            "created_at": row["created_at"].isoformat(),
+            "title": row["title"] or "New Conversation",
+            "messages": row["messages"]
+        }
+        if generation == _conversation_generation:
+            _conversation_cache.set(cache_key, (user_id, orjson.dumps(conversation)))
+        return conversation
+
+
+async def get_conversation_metadata(conversation_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Load a conversation's metadata without its messages.
+
+    Use this instead of get_conversation when a handler only needs to check
+    ownership or whether the conversation has any messages yet; it avoids
+    reading and decoding every message's stage payloads.
+
+    Args:
+        conversation_id: Unique identifier for the conversation
+        user_id: The Clerk user ID (for ownership check)
+
+    Returns:
+        Dict with id, created_at, title and message_count (user messages),
+        or None if not found
+    """
+    async with get_connection() as conn:
+        row = await conn.fetchrow(
             """
-            SELECT id, role, content, stage1, stage2, stage3
-            FROM messages
-            WHERE conversation_id = $1
-            ORDER BY created_at ASC
+            SELECT id, title, created_at, message_count
+            FROM conversations
+            WHERE id = $1 AND user_id = $2
             """,
-            UUID(conversation_id)
+            conversation_id,
+            user_id
         )
 
-        message_list = []
-
-        for msg in messages:
-            if msg["role"] == "user":
-                message_list.append({
-                    "id": msg["id"],  # Include ID for tracking
-                    "role": "user",
-                    "content": msg["content"]
-                })
-            else:
-                # Skip assistant messages with no stage data at all
-                # (these are orphaned from interrupted processing)
-                if msg["stage1"] is None and msg["stage2"] is None and msg["stage3"] is None:
-                    continue
-
-                message_list.append({
-                    "id": msg["id"],  # Include ID for responding to specific decisions
-                    "role": "assistant",
-                    "stage1": parse_json_field(msg["stage1"]),
-                    "stage2": parse_json_field(msg["stage2"]),
-                    "stage3": parse_json_field(msg["stage3"])
-                })
+        if row is None:
+            return None
 
         return {
             "id": str(row["id"]),
             "created_at": row["created_at"].isoformat(),
             "title": row["title"] or "New Conversation",
-            "messages": message_list
+            "message_count": row["message_count"] or 0
         }
 
 
+def _encode_conversation_cursor(sort_at: datetime, conversation_id: Any) -> str:
+    """Encode a conversation's sort position as an opaque page cursor."""
+    raw = f"{sort_at.isoformat()}|{conversation_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_conversation_cursor(cursor: str) -> Tuple[datetime, str]:
+    """
+    Decode a cursor from _encode_conversation_cursor.
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        sort_at, conversation_id = raw.split("|")
+        sort_time = datetime.fromisoformat(sort_at)
+        # The sort key is a naive TIMESTAMP; asyncpg won't bind an aware value
+        if sort_time.tzinfo is not None:
+            raise ValueError("Cursor timestamp must be naive")
+        return sort_time, str(UUID(conversation_id))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError("Invalid pagination cursor") from e
+
+
 async def list_conversations(
     user_id: str,
     limit: int = 50,
-    offset: int = 0
+    offset: int = 0,
+    cursor: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     List conversations for a user with pagination.
 
+    Supports two pagination styles:
+    - Keyset: pass the previous page's ``next_cursor`` as ``cursor``. Each page
+      is a bounded index range scan regardless of how deep the user pages.
+      The cursor encodes the last row's (sort time, id), so conversations
+      sharing a timestamp are neither skipped nor repeated.
+    - Offset: legacy ``offset`` paging, used when no cursor is given.
+
     Args:
         user_id: The Clerk user ID
         limit: Maximum number of conversations to return (default 50, max 100)
-        offset: Number of conversations to skip (for pagination)
+        offset: Number of conversations to skip (ignored when cursor is set)
+        cursor: Opaque cursor from a previous page's ``next_cursor``
 
     Returns:
-        Dict with 'conversations' list and 'total' count
+        Dict with 'conversations' list, 'total' count and 'next_cursor'.
+        'total' is only computed for offset paging and is None for keyset
+        pages, which rely on 'has_more'/'next_cursor' instead.
+
+    Raises:
+        ValueError: If the cursor is malformed
     """
     # Enforce limits
     limit = min(max(1, limit), 100)
     offset = max(0, offset)
 
-    async with get_connection() as conn:
-        # Get total count
-        total = await conn.fetchval(
-            "SELECT COUNT(*) FROM conversations WHERE user_id = $1",
-            user_id
-        )
+    before = _decode_conversation_cursor(cursor) if cursor else None
 
-        # Get paginated results - only count user messages (queries), not assistant responses
+    async with get_connection() as conn:
+        # Get paginated results - message_count is the trigger-maintained
+        # count of user messages (queries), not assistant responses
         # Sort by updated_at (most recently edited first) with fallback to created_at
-        rows = await conn.fetch(
-            """
-            SELECT c.id, c.title, c.created_at, c.updated_at,
-                   COUNT(m.id) FILTER (WHERE m.role = 'user') as message_count
-            FROM conversations c
-            LEFT JOIN messages m ON m.conversation_id = c.id
-            WHERE c.user_id = $1
-            GROUP BY c.id
-            ORDER BY COALESCE(c.updated_at, c.created_at) DESC
-            LIMIT $2 OFFSET $3
-            """,
-            user_id,
-            limit,
-            offset
-        )
+        # Keyset pages fetch one extra row to learn whether another page exists
+        if before is not None:
+            rows = await conn.fetch(
+                """
+                SELECT c.id, c.title, c.created_at, c.message_count,
+                       COALESCE(c.updated_at, c.created_at) as sort_at
+                FROM conversations c
+                WHERE c.user_id = $1
+                  AND (COALESCE(c.updated_at, c.created_at), c.id) < ($2, $3)
+                ORDER BY COALESCE(c.updated_at, c.created_at) DESC, c.id DESC
+                LIMIT $4
+                """,
+                user_id,
+                before[0],
+                before[1],
+                limit + 1
+            )
+        else:
+            # The window count returns the total alongside the page
+            rows = await conn.fetch(
+                """
+                SELECT c.id, c.title, c.created_at, c.message_count,
+                       COALESCE(c.updated_at, c.created_at) as sort_at,
+                       COUNT(*) OVER () as total_count
+                FROM conversations c
+                WHERE c.user_id = $1
+                ORDER BY COALESCE(c.updated_at, c.created_at) DESC, c.id DESC
+                LIMIT $2 OFFSET $3
+                """,
+                user_id,
+                limit,
+                offset
+            )
+
+        if before is not None:
+            # Keyset pages don't need a total; has_more comes from the sentinel
+            total = None
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+        else:
+            if rows:
+                total = rows[0]["total_count"]
+            elif offset == 0:
+                total = 0
+            else:
+                # Past the last page the window count has no row to ride on
+                total = await conn.fetchval(
+                    "SELECT COUNT(*) FROM conversations WHERE user_id = $1",
+                    user_id
+                )
+            has_more = offset + len(rows) < total
 
         conversations = [
             {
@@ -209,7 +401,11 @@ async def list_conversations(
             "total": total,
             "limit": limit,
             "offset": offset,
-            "has_more": offset + len(conversations) < total
+            "has_more": has_more,
+            "next_cursor": (
+                _encode_conversation_cursor(rows[-1]["sort_at"], rows[-1]["id"])
+                if rows and has_more else None
+            )
         }
 
 
@@ -222,19 +418,19 @@ async def add_user_message(conversation_id: str, content: str):
         content: User message content
     """
     async with get_connection() as conn:
+        # Insert and bump the conversation's updated_at in one statement
         await conn.execute(
             """
-            INSERT INTO messages (conversation_id, role, content, created_at)
-            VALUES ($1, 'user', $2, NOW())
+            WITH new_message AS (
+                INSERT INTO messages (conversation_id, role, content, created_at)
+                VALUES ($1, 'user', $2, NOW())
+            )
+            UPDATE conversations SET updated_at = NOW() WHERE id = $1
             """,
-            UUID(conversation_id),
+            conversation_id,
             content
         )
-        # Update conversation's updated_at timestamp
-        await conn.execute(
-            "UPDATE conversations SET updated_at = NOW() WHERE id = $1",
-            UUID(conversation_id)
-        )
+    invalidate_conversation_cache(conversation_id)
 
 
 async def add_assistant_message(
@@ -258,28 +454,47 @@ async def add_assistant_message(
             INSERT INTO messages (conversation_id, role, stage1, stage2, stage3, created_at)
             VALUES ($1, 'assistant', $2, $3, $4, NOW())
             """,
-            UUID(conversation_id),
-            json.dumps(stage1),
-            json.dumps(stage2),
-            json.dumps(stage3)
+            conversation_id,
+            stage1,
+            stage2,
+            stage3
         )
+    invalidate_conversation_cache(conversation_id)
 
 
-async def create_pending_assistant_message(conversation_id: str) -> int:
+async def create_pending_assistant_message(
+    conversation_id: str,
+    stage1: Optional[List[Dict[str, Any]]] = None
+) -> int:
     """
     Create a pending assistant message placeholder.
     Returns the message ID for later updates.
+
+    Pass stage1 when it is already available to store it with the insert
+    instead of following up with update_assistant_message_stage.
     """
     async with get_connection() as conn:
         row = await conn.fetchrow(
             """
-            INSERT INTO messages (conversation_id, role, created_at)
-            VALUES ($1, 'assistant', NOW())
+            INSERT INTO messages (conversation_id, role, stage1, created_at)
+            VALUES ($1, 'assistant', $2, NOW())
             RETURNING id
             """,
-            UUID(conversation_id)
+            conversation_id,
+            stage1
         )
-        return row["id"]
+    invalidate_conversation_cache(conversation_id)
+    return row["id"]
+
+
+# Assistant message stage columns that may be written
+ASSISTANT_STAGE_COLUMNS = ("stage1", "stage1_5", "stage2", "stage3")
+
+# One prebuilt UPDATE per writable stage column
+_UPDATE_STAGE_SQL = {
+    column: f"UPDATE messages SET {column} = $1 WHERE id = $2 RETURNING conversation_id"
+    for column in ASSISTANT_STAGE_COLUMNS
+}
 
 
 async def update_assistant_message_stage(message_id: int, stage: str, data: Any):
@@ -291,56 +506,86 @@ async def update_assistant_message_stage(message_id: int, stage: str, data: Any)
         stage: 'stage1', 'stage1_5', 'stage2', or 'stage3'
         data: The stage data to save
     """
-    # SECURITY: Use explicit mapping to prevent SQL injection
-    # Column names cannot be parameterized, so we use a whitelist
-    STAGE_COLUMNS = {
-        'stage1': 'stage1',
-        'stage1_5': 'stage1_5',
-        'stage2': 'stage2',
-        'stage3': 'stage3'
-    }
-
-    column = STAGE_COLUMNS.get(stage)
-    if not column:
+    # SECURITY: Column names cannot be parameterized, so only stages with a
+    # prebuilt statement can be written
+    sql = _UPDATE_STAGE_SQL.get(stage)
+    if not sql:
         raise ValueError(f"Invalid stage: {stage}")
 
     async with get_connection() as conn:
-        # Use the validated column name from our whitelist
-        if column == 'stage1':
-            await conn.execute(
-                "UPDATE messages SET stage1 = $1 WHERE id = $2",
-                json.dumps(data),
-                message_id
-            )
-        elif column == 'stage1_5':
-            await conn.execute(
-                "UPDATE messages SET stage1_5 = $1 WHERE id = $2",
-                json.dumps(data),
-                message_id
-            )
-        elif column == 'stage2':
-            await conn.execute(
-                "UPDATE messages SET stage2 = $1 WHERE id = $2",
-                json.dumps(data),
-                message_id
-            )
-        else:  # stage3
-            await conn.execute(
-                "UPDATE messages SET stage3 = $1 WHERE id = $2",
-                json.dumps(data),
-                message_id
-            )
+        conversation_id = await conn.fetchval(sql, data, message_id)
+    _stage3_response_cache.pop(("message", message_id))
+    if conversation_id is not None:
+        invalidate_conversation_cache(conversation_id)
+
+
+# UPDATE statements built by update_assistant_message_stages, keyed by the
+# tuple of columns they set, so each combination is formatted only once
+_UPDATE_STAGES_SQL: Dict[Tuple[str, ...], str] = {}
+
+
+async def update_assistant_message_stages(message_id: int, **stages: Any):
+    """
+    Update several stages of an assistant message in one UPDATE.
+
+    Args:
+        message_id: The message ID
+        **stages: Stage data keyed by stage name ('stage1', 'stage1_5',
+            'stage2', 'stage3'). Only the stages passed with a value other
+            than None are written.
+
+    Raises:
+        ValueError: If no stage data is given or a stage name is invalid
+    """
+    # SECURITY: Column names cannot be parameterized, so only whitelisted
+    # names are interpolated; all values are bound parameters
+    invalid = [stage for stage in stages if stage not in ASSISTANT_STAGE_COLUMNS]
+    if invalid:
+        raise ValueError(f"Invalid stage: {invalid[0]}")
+
+    columns = tuple(
+        column for column in ASSISTANT_STAGE_COLUMNS
+        if stages.get(column) is not None
+    )
+    if not columns:
+        raise ValueError("No stages to update")
+
+    sql = _UPDATE_STAGES_SQL.get(columns)
+    if sql is None:
+        assignments = ", ".join(
+            f"{column} = ${index}" for index, column in enumerate(columns, start=1)
+        )
+        sql = (
+            f"UPDATE messages SET {assignments} WHERE id = ${len(columns) + 1} "
+            "RETURNING conversation_id"
+        )
+        _UPDATE_STAGES_SQL[columns] = sql
+
+    async with get_connection() as conn:
+        conversation_id = await conn.fetchval(
+            sql,
+            *(stages[column] for column in columns),
+            message_id
+        )
+    _stage3_response_cache.pop(("message", message_id))
+    if conversation_id is not None:
+        invalidate_conversation_cache(conversation_id)
 
 
-async def update_conversation_title(conversation_id: str, title: str):
+async def update_conversation_title(
+    conversation_id: str,
+    title: str,
+    conn: Optional[asyncpg.Connection] = None
+):
     """
     Update the title of a conversation.
 
     Args:
         conversation_id: Conversation identifier
         title: New title for the conversation
+        conn: Optional connection to reuse instead of acquiring one
     """
-    async with get_connection() as conn:
+    async with get_connection(conn) as conn:
         await conn.execute(
             """
             UPDATE conversations
@@ -348,8 +593,9 @@ async def update_conversation_title(conversation_id: str, title: str):
             WHERE id = $2
             """,
             title,
-            UUID(conversation_id)
+            conversation_id
         )
+    invalidate_conversation_cache(conversation_id)
 
 
 async def delete_conversation(conversation_id: str, user_id: str) -> bool:
@@ -365,15 +611,19 @@ async def delete_conversation(conversation_id: str, user_id: str) -> bool:
     """
     async with get_connection() as conn:
         # Delete conversation (messages will cascade delete)
-        result = await conn.execute(
+        deleted_id = await conn.fetchval(
             """
             DELETE FROM conversations
             WHERE id = $1 AND user_id = $2
+            RETURNING id
             """,
-            UUID(conversation_id),
+            conversation_id,
             user_id
         )
-        return result == "DELETE 1"
+    if deleted_id is None:
+        return False
+    invalidate_conversation_cache(deleted_id, messages_deleted=True)
+    return True
 
 
 # User management functions
@@ -390,36 +640,37 @@ async def get_or_create_user(user_id: str, email: str) -> Dict[str, Any]:
         User dict with id, email, credits
     """
     async with get_connection() as conn:
-        # Try to get existing user
+        # Create the user with 5 free credits if missing, returning either the
+        # new row or the existing one in a single round trip. The existing
+        # row is read from the statement snapshot, so a user created
+        # concurrently after it was taken falls through to the SELECT below.
         row = await conn.fetchrow(
-            "SELECT id, email, credits, email_verified FROM users WHERE id = $1",
-            user_id
-        )
-
-        if row:
-            return {
-                "id": row["id"],
-                "email": row["email"],
-                "credits": row["credits"],
-                "email_verified": row["email_verified"] or False
-            }
-
-        # Create new user with 5 free credits
-        await conn.execute(
             """
-            INSERT INTO users (id, email, credits, auth_provider, created_at)
-            VALUES ($1, $2, 5, 'email', NOW())
-            ON CONFLICT (id) DO NOTHING
+            WITH inserted AS (
+                INSERT INTO users (id, email, credits, auth_provider, created_at)
+                VALUES ($1, $2, 5, 'email', NOW())
+                ON CONFLICT (id) DO NOTHING
+                RETURNING id, email, credits, email_verified
+            )
+            SELECT id, email, credits, email_verified FROM inserted
+            UNION ALL
+            SELECT id, email, credits, email_verified FROM users WHERE id = $1
+            LIMIT 1
             """,
             user_id,
             email
         )
+        if row is None:
+            row = await conn.fetchrow(
+                "SELECT id, email, credits, email_verified FROM users WHERE id = $1",
+                user_id
+            )
 
         return {
-            "id": user_id,
-            "email": email,
-            "credits": 5,
-            "email_verified": False
+            "id": row["id"],
+            "email": row["email"],
+            "credits": row["credits"],
+            "email_verified": row["email_verified"] or False
         }
 
 
@@ -444,30 +695,29 @@ async def create_user_with_password(
     """
     import uuid
     user_id = str(uuid.uuid4())
+    email = email.lower()
 
     async with get_connection() as conn:
-        # Check if email already exists
-        existing = await conn.fetchrow(
-            "SELECT id FROM users WHERE email = $1",
-            email.lower()
-        )
-        if existing:
-            raise ValueError("Email already registered")
-
-        await conn.execute(
+        # The unique email indexes reject duplicates (in any letter case)
+        # atomically
+        inserted_id = await conn.fetchval(
             """
             INSERT INTO users (id, email, password_hash, auth_provider, credits, created_at)
             VALUES ($1, $2, $3, 'email', $4, NOW())
+            ON CONFLICT DO NOTHING
+            RETURNING id
             """,
             user_id,
-            email.lower(),
+            email,
             password_hash,
             initial_credits
         )
+        if inserted_id is None:
+            raise ValueError("Email already registered")
 
         return {
             "id": user_id,
-            "email": email.lower(),
+            "email": email,
             "credits": initial_credits,
             "email_verified": False,
             "role": "user"  # New users always start as regular users
@@ -485,12 +735,16 @@ async def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
         User dict or None if not found
     """
     async with get_connection() as conn:
+        # If legacy rows differ only by case, prefer the exact (lowercase)
+        # address, then the oldest account, so the match is deterministic
         row = await conn.fetchrow(
             """
             SELECT id, email, password_hash, credits, email_verified, auth_provider, role
-            FROM users WHERE email = $1
+            FROM users WHERE LOWER(email) = LOWER($1)
+            ORDER BY email = LOWER($1) DESC, created_at
+            LIMIT 1
             """,
-            email.lower()
+            email
         )
 
         if row:
@@ -516,6 +770,10 @@ async def get_user_by_id(user_id: str) -> Optional[Dict[str, Any]]:
     Returns:
         User dict or None if not found
     """
+    cached = _user_cache.get(user_id)
+    if cached is not None:
+        return dict(cached)
+
     async with get_connection() as conn:
         row = await conn.fetchrow(
             """
@@ -526,7 +784,7 @@ async def get_user_by_id(user_id: str) -> Optional[Dict[str, Any]]:
         )
 
         if row:
-            return {
+            user = {
                 "id": row["id"],
                 "email": row["email"],
                 "credits": row["credits"],
@@ -536,6 +794,8 @@ async def get_user_by_id(user_id: str) -> Optional[Dict[str, Any]]:
                 "password_hash": row["password_hash"],
                 "stripe_customer_id": row["stripe_customer_id"]
             }
+            _user_cache.set(user_id, user)
+            return dict(user)
         return None
 
 
@@ -556,6 +816,7 @@ async def update_user_stripe_customer(user_id: str, stripe_customer_id: str) ->
             stripe_customer_id,
             user_id
         )
+        invalidate_user_cache(user_id)
         return result == "UPDATE 1"
 
 
@@ -576,25 +837,37 @@ async def update_user_password(user_id: str, password_hash: str) -> bool:
             password_hash,
             user_id
         )
+        invalidate_user_cache(user_id)
         return result == "UPDATE 1"
 
 
-async def get_user_credits(user_id: str) -> int:
+async def get_user_credits(
+    user_id: str,
+    conn: Optional[asyncpg.Connection] = None
+) -> int:
     """
     Get the current credit balance for a user.
 
     Args:
         user_id: Clerk user ID
+        conn: Optional connection to reuse instead of acquiring one
 
     Returns:
         Number of credits remaining
     """
-    async with get_connection() as conn:
+    cached = _user_credits_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    async with get_connection(conn) as conn:
         row = await conn.fetchrow(
             "SELECT credits FROM users WHERE id = $1",
             user_id
         )
-        return row["credits"] if row else 0
+    if row is None:
+        return 0
+    _user_credits_cache.set(user_id, row["credits"])
+    return row["credits"]
 
 
 async def deduct_credit(user_id: str) -> bool:
@@ -631,6 +904,7 @@ async def deduct_credits(user_id: str, amount: int) -> bool:
             amount,
             user_id
         )
+        invalidate_user_cache(user_id)
         # Returns "UPDATE X" where X is number of rows affected
         return result == "UPDATE 1"
 
@@ -647,24 +921,27 @@ async def deduct_credits_and_get_remaining(user_id: str, amount: int) -> tuple[b
         Tuple of (success, remaining_credits)
     """
     async with get_connection() as conn:
+        # Deduct and, if the balance was too low, read the current balance
+        # in the same round trip
         row = await conn.fetchrow(
             """
-            UPDATE users
-            SET credits = credits - $1
-            WHERE id = $2 AND credits >= $1
-            RETURNING credits
+            WITH deducted AS (
+                UPDATE users
+                SET credits = credits - $1
+                WHERE id = $2 AND credits >= $1
+                RETURNING credits
+            )
+            SELECT EXISTS (SELECT 1 FROM deducted) as success,
+                   COALESCE(
+                       (SELECT credits FROM deducted),
+                       (SELECT credits FROM users WHERE id = $2)
+                   ) as credits
             """,
             amount,
             user_id
         )
-        if row:
-            return True, row["credits"]
-        # If update failed, get current credits
-        current = await conn.fetchval(
-            "SELECT credits FROM users WHERE id = $1",
-            user_id
-        )
-        return False, current or 0
+        invalidate_user_cache(user_id)
+        return row["success"], row["credits"] or 0
 
 
 class InsufficientCreditsError(Exception):
@@ -693,25 +970,29 @@ async def reserve_credits_atomic(user_id: str, amount: int) -> int:
         InsufficientCreditsError: If user doesn't have enough credits
     """
     async with get_connection() as conn:
+        # Reserve and, if the balance was too low, read the current balance
+        # for the error in the same round trip
         row = await conn.fetchrow(
             """
-            UPDATE users
-            SET credits = credits - $1
-            WHERE id = $2 AND credits >= $1
-            RETURNING credits
+            WITH reserved AS (
+                UPDATE users
+                SET credits = credits - $1
+                WHERE id = $2 AND credits >= $1
+                RETURNING credits
+            )
+            SELECT EXISTS (SELECT 1 FROM reserved) as success,
+                   COALESCE(
+                       (SELECT credits FROM reserved),
+                       (SELECT credits FROM users WHERE id = $2)
+                   ) as credits
             """,
             amount,
             user_id
         )
-        if row:
+        invalidate_user_cache(user_id)
+        if row["success"]:
             return row["credits"]
-
-        # Get current credits for error message
-        current = await conn.fetchval(
-            "SELECT credits FROM users WHERE id = $1",
-            user_id
-        )
-        raise InsufficientCreditsError(required=amount, available=current or 0)
+        raise InsufficientCreditsError(required=amount, available=row["credits"] or 0)
 
 
 async def refund_credits(user_id: str, amount: int) -> int:
@@ -736,6 +1017,7 @@ async def refund_credits(user_id: str, amount: int) -> int:
             amount,
             user_id
         )
+        invalidate_user_cache(user_id)
         return row["credits"] if row else 0
 
 
@@ -757,6 +1039,7 @@ async def add_credits(user_id: str, amount: int):
             amount,
             user_id
         )
+    invalidate_user_cache(user_id)
 
 
 async def record_payment(
@@ -837,52 +1120,49 @@ async def mark_payment_refunded(payment_intent_id: str, refund_amount_cents: int
         True if payment was found and updated, False otherwise
     """
     async with get_connection() as conn:
-        # Get the original payment
-        payment = await conn.fetchrow(
+        # Lock the payment, update its status and deduct credits in one
+        # atomic statement. A full refund deducts all credits; a partial one
+        # deducts proportionally (rounded down). Balances never go below 0.
+        row = await conn.fetchrow(
             """
-            SELECT user_id, amount_cents, credits, status
-            FROM payments
-            WHERE stripe_payment_intent = $1
+            WITH payment AS (
+                SELECT user_id,
+                       CASE WHEN $2 >= amount_cents
+                            THEN 'refunded' ELSE 'partially_refunded'
+                       END as new_status,
+                       CASE WHEN amount_cents > 0
+                            THEN ($2::bigint * credits / amount_cents)::integer
+                            ELSE credits
+                       END as credits_to_deduct
+                FROM payments
+                WHERE stripe_payment_intent = $1
+                LIMIT 1
+                FOR UPDATE
+            ),
+            updated_payment AS (
+                UPDATE payments p
+                SET status = payment.new_status
+                FROM payment
+                WHERE p.stripe_payment_intent = $1
+            ),
+            updated_user AS (
+                UPDATE users u
+                SET credits = GREATEST(0, u.credits - payment.credits_to_deduct)
+                FROM payment
+                WHERE u.id = payment.user_id
+            )
+            SELECT TRUE as found, user_id FROM payment
             """,
-            payment_intent_id
+            payment_intent_id,
+            refund_amount_cents
         )
 
-        if not payment:
+        if row is None:
             return False
 
-        # Calculate credits to deduct proportionally
-        # If full refund, deduct all credits. If partial, deduct proportionally.
-        original_amount = payment["amount_cents"]
-        original_credits = payment["credits"]
-
-        if original_amount > 0:
-            credits_to_deduct = int((refund_amount_cents / original_amount) * original_credits)
-        else:
-            credits_to_deduct = original_credits
-
-        # Update payment status
-        new_status = "refunded" if refund_amount_cents >= original_amount else "partially_refunded"
-        await conn.execute(
-            """
-            UPDATE payments
-            SET status = $1
-            WHERE stripe_payment_intent = $2
-            """,
-            new_status,
-            payment_intent_id
-        )
-
-        # Deduct credits from user (but don't go below 0)
-        await conn.execute(
-            """
-            UPDATE users
-            SET credits = GREATEST(0, credits - $1)
-            WHERE id = $2
-            """,
-            credits_to_deduct,
-            payment["user_id"]
-        )
-
+        # The payment outlives a deleted user (user_id set to NULL)
+        if row["user_id"] is not None:
+            invalidate_user_cache(row["user_id"])
         return True
 
 
@@ -913,39 +1193,35 @@ async def add_assistant_message_with_mode(
         The ID of the created message
     """
     async with get_connection() as conn:
-        # Calculate revision number for reruns
-        revision_number = 0
-        if is_rerun and parent_message_id:
-            row = await conn.fetchrow(
-                """
-                SELECT COALESCE(MAX(revision_number), 0) + 1 as next_revision
-                FROM messages
-                WHERE parent_message_id = $1 OR id = $1
-                """,
-                parent_message_id
-            )
-            revision_number = row["next_revision"] if row else 1
-
+        # Reruns get the next revision number, computed in the same statement
         row = await conn.fetchrow(
             """
             INSERT INTO messages (
                 conversation_id, role, stage1, stage2, stage3,
                 mode, is_rerun, rerun_input, revision_number, parent_message_id, created_at
             )
-            VALUES ($1, 'assistant', $2, $3, $4, $5, $6, $7, $8, $9, NOW())
+            VALUES (
+                $1, 'assistant', $2, $3, $4, $5, $6, $7,
+                CASE WHEN $6::boolean AND $8::integer IS NOT NULL THEN (
+                    SELECT COALESCE(MAX(revision_number), 0) + 1
+                    FROM messages
+                    WHERE parent_message_id = $8 OR id = $8
+                ) ELSE 0 END,
+                $8, NOW()
+            )
             RETURNING id
             """,
-            UUID(conversation_id),
-            json.dumps(stage1),
-            json.dumps(stage2),
-            json.dumps(stage3),
+            conversation_id,
+            stage1,
+            stage2,
+            stage3,
             mode,
             is_rerun,
             rerun_input,
-            revision_number,
             parent_message_id
         )
-        return row["id"]
+    invalidate_conversation_cache(conversation_id)
+    return row["id"]
 
 
 async def add_assistant_message_complete(
@@ -957,7 +1233,8 @@ async def add_assistant_message_complete(
     mode: str = "standard",
     is_rerun: bool = False,
     rerun_input: Optional[str] = None,
-    parent_message_id: Optional[int] = None
+    parent_message_id: Optional[int] = None,
+    conn: Optional[asyncpg.Connection] = None
 ) -> int:
     """
     Add a complete assistant message with ALL stages in a single atomic transaction.
@@ -976,50 +1253,49 @@ async def add_assistant_message_complete(
         is_rerun: Whether this is a rerun of a previous decision
         rerun_input: New input provided for rerun (if any)
         parent_message_id: ID of the original message this is a rerun of
+        conn: Optional connection to reuse instead of acquiring one
 
     Returns:
         The ID of the created message
     """
-    async with get_connection() as conn:
-        # Calculate revision number for reruns
-        revision_number = 0
-        if is_rerun and parent_message_id:
-            row = await conn.fetchrow(
-                """
-                SELECT COALESCE(MAX(revision_number), 0) + 1 as next_revision
-                FROM messages
-                WHERE parent_message_id = $1 OR id = $1
-                """,
-                parent_message_id
-            )
-            revision_number = row["next_revision"] if row else 1
-
+    async with get_connection(conn) as conn:
+        # Insert and bump the conversation's updated_at in one statement,
+        # so both changes commit together. Reruns get the next revision
+        # number, computed in the same statement.
         row = await conn.fetchrow(
             """
-            INSERT INTO messages (
-                conversation_id, role, stage1, stage1_5, stage2, stage3,
-                mode, is_rerun, rerun_input, revision_number, parent_message_id, created_at
+            WITH new_message AS (
+                INSERT INTO messages (
+                    conversation_id, role, stage1, stage1_5, stage2, stage3,
+                    mode, is_rerun, rerun_input, revision_number, parent_message_id, created_at
+                )
+                VALUES (
+                    $1, 'assistant', $2, $3, $4, $5, $6, $7, $8,
+                    CASE WHEN $7::boolean AND $9::integer IS NOT NULL THEN (
+                        SELECT COALESCE(MAX(revision_number), 0) + 1
+                        FROM messages
+                        WHERE parent_message_id = $9 OR id = $9
+                    ) ELSE 0 END,
+                    $9, NOW()
+                )
+                RETURNING id
+            ), touch AS (
+                UPDATE conversations SET updated_at = NOW() WHERE id = $1
             )
-            VALUES ($1, 'assistant', $2, $3, $4, $5, $6, $7, $8, $9, $10, NOW())
-            RETURNING id
+            SELECT id FROM new_message
             """,
-            UUID(conversation_id),
-            json.dumps(stage1),
-            json.dumps(stage1_5) if stage1_5 else None,
-            json.dumps(stage2),
-            json.dumps(stage3),
+            conversation_id,
+            stage1,
+            stage1_5 or None,
+            stage2,
+            stage3,
             mode,
             is_rerun,
             rerun_input,
-            revision_number,
             parent_message_id
         )
-        # Update conversation's updated_at timestamp
-        await conn.execute(
-            "UPDATE conversations SET updated_at = NOW() WHERE id = $1",
-            UUID(conversation_id)
-        )
-        return row["id"]
+    invalidate_conversation_cache(conversation_id)
+    return row["id"]
 
 
 async def get_message_revisions(conversation_id: str, message_id: int) -> List[Dict[str, Any]]:
@@ -1034,35 +1310,36 @@ async def get_message_revisions(conversation_id: str, message_id: int) -> List[D
         List of revision dicts sorted by revision number
     """
     async with get_connection() as conn:
-        rows = await conn.fetch(
+        # Build the revision list server-side so it is decoded in one pass
+        revisions = await conn.fetchval(
             """
-            SELECT id, stage1, stage2, stage3, mode, is_rerun, rerun_input,
-                   revision_number, parent_message_id, created_at
+            SELECT COALESCE(
+                json_agg(
+                    json_build_object(
+                        'id', id,
+                        'stage1', stage1,
+                        'stage2', stage2,
+                        'stage3', stage3,
+                        'mode', COALESCE(mode, 'standard'),
+                        'is_rerun', COALESCE(is_rerun, FALSE),
+                        'rerun_input', rerun_input,
+                        'revision_number', COALESCE(revision_number, 0),
+                        'parent_message_id', parent_message_id,
+                        'created_at', created_at
+                    ) ORDER BY revision_number ASC, created_at ASC
+                ),
+                '[]'
+            )
             FROM messages
             WHERE (id = $1 OR parent_message_id = $1)
               AND conversation_id = $2
               AND role = 'assistant'
-            ORDER BY revision_number ASC, created_at ASC
             """,
             message_id,
-            UUID(conversation_id)
+            conversation_id
         )
 
-        return [
-            {
-                "id": row["id"],
-                "stage1": parse_json_field(row["stage1"]),
-                "stage2": parse_json_field(row["stage2"]),
-                "stage3": parse_json_field(row["stage3"]),
-                "mode": row["mode"] or "standard",
-                "is_rerun": row["is_rerun"] or False,
-                "rerun_input": row["rerun_input"],
-                "revision_number": row["revision_number"] or 0,
-                "parent_message_id": row["parent_message_id"],
-                "created_at": row["created_at"].isoformat() if row["created_at"] else None
-            }
-            for row in rows
-        ]
+        return revisions
 
 
 async def get_latest_assistant_message(conversation_id: str) -> Optional[Dict[str, Any]]:
@@ -1085,7 +1362,7 @@ async def get_latest_assistant_message(conversation_id: str) -> Optional[Dict[st
             ORDER BY created_at DESC
             LIMIT 1
             """,
-            UUID(conversation_id)
+            conversation_id
         )
 
         if row is None:
@@ -1093,9 +1370,9 @@ async def get_latest_assistant_message(conversation_id: str) -> Optional[Dict[st
 
         return {
             "id": row["id"],
-            "stage1": parse_json_field(row["stage1"]),
-            "stage2": parse_json_field(row["stage2"]),
-            "stage3": parse_json_field(row["stage3"]),
+            "stage1": row["stage1"],
+            "stage2": row["stage2"],
+            "stage3": row["stage3"],
             "mode": row["mode"] or "standard",
             "is_rerun": row["is_rerun"] or False,
             "revision_number": row["revision_number"] or 0,
@@ -1129,7 +1406,7 @@ async def get_orphaned_user_message(conversation_id: str) -> Optional[Dict[str,
             ORDER BY created_at DESC
             LIMIT 1
             """,
-            UUID(conversation_id)
+            conversation_id
         )
 
         if last_msg is None:
@@ -1156,6 +1433,12 @@ async def get_original_user_message(conversation_id: str) -> Optional[str]:
     Returns:
         The original user message content or None
     """
+    cache_key = _conversation_key(conversation_id)
+    cached = _original_message_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    generation = _conversation_generation
     async with get_connection() as conn:
         row = await conn.fetchrow(
             """
@@ -1165,10 +1448,14 @@ async def get_original_user_message(conversation_id: str) -> Optional[str]:
             ORDER BY created_at ASC
             LIMIT 1
             """,
-            UUID(conversation_id)
+            conversation_id
         )
 
-        return row["content"] if row else None
+    if row is None:
+        return None
+    if generation == _conversation_generation:
+        _original_message_cache.set(cache_key, row["content"])
+    return row["content"]
 
 
 async def create_pending_assistant_message_with_mode(
@@ -1176,7 +1463,8 @@ async def create_pending_assistant_message_with_mode(
     mode: str = "standard",
     is_rerun: bool = False,
     rerun_input: Optional[str] = None,
-    parent_message_id: Optional[int] = None
+    parent_message_id: Optional[int] = None,
+    stage1: Optional[List[Dict[str, Any]]] = None
 ) -> int:
     """
     Create a pending assistant message placeholder with mode info.
@@ -1187,41 +1475,39 @@ async def create_pending_assistant_message_with_mode(
         is_rerun: Whether this is a rerun
         rerun_input: New input for rerun
         parent_message_id: Original message ID for reruns
+        stage1: Stage 1 results, if already available, stored with the insert
 
     Returns:
         The message ID for later updates
     """
     async with get_connection() as conn:
-        # Calculate revision number for reruns
-        revision_number = 0
-        if is_rerun and parent_message_id:
-            row = await conn.fetchrow(
-                """
-                SELECT COALESCE(MAX(revision_number), 0) + 1 as next_revision
-                FROM messages
-                WHERE parent_message_id = $1 OR id = $1
-                """,
-                parent_message_id
-            )
-            revision_number = row["next_revision"] if row else 1
-
+        # Reruns get the next revision number, computed in the same statement
         row = await conn.fetchrow(
             """
             INSERT INTO messages (
                 conversation_id, role, mode, is_rerun, rerun_input,
-                revision_number, parent_message_id, created_at
+                revision_number, parent_message_id, stage1, created_at
+            )
+            VALUES (
+                $1, 'assistant', $2, $3, $4,
+                CASE WHEN $3::boolean AND $5::integer IS NOT NULL THEN (
+                    SELECT COALESCE(MAX(revision_number), 0) + 1
+                    FROM messages
+                    WHERE parent_message_id = $5 OR id = $5
+                ) ELSE 0 END,
+                $5, $6, NOW()
             )
-            VALUES ($1, 'assistant', $2, $3, $4, $5, $6, NOW())
             RETURNING id
             """,
-            UUID(conversation_id),
+            conversation_id,
             mode,
             is_rerun,
             rerun_input,
-            revision_number,
-            parent_message_id
+            parent_message_id,
+            stage1
         )
-        return row["id"]
+    invalidate_conversation_cache(conversation_id)
+    return row["id"]
 
 
 # ============== Role Management ==============
@@ -1247,6 +1533,7 @@ async def update_user_role(user_id: str, new_role: str) -> bool:
             new_role,
             user_id
         )
+        invalidate_user_cache(user_id)
         return result == "UPDATE 1"
 
 
@@ -1265,7 +1552,11 @@ async def get_staff_users() -> List[Dict[str, Any]]:
     async with get_connection() as conn:
         rows = await conn.fetch(
             """
-            SELECT id, email, role, credits, created_at
+            SELECT id, email, role, credits,
+                   CASE WHEN date_trunc('second', created_at) = created_at
+                        THEN to_char(created_at, 'YYYY-MM-DD"T"HH24:MI:SS')
+                        ELSE to_char(created_at, 'YYYY-MM-DD"T"HH24:MI:SS.US')
+                   END as created_at
             FROM users
             WHERE role IN ('employee', 'admin', 'superadmin')
             ORDER BY
@@ -1274,19 +1565,12 @@ async def get_staff_users() -> List[Dict[str, Any]]:
                     WHEN 'admin' THEN 2
                     WHEN 'employee' THEN 3
                 END,
-                created_at DESC
+                users.created_at DESC
             """
         )
-        return [
-            {
-                "id": row["id"],
-                "email": row["email"],
-                "role": row["role"],
-                "credits": row["credits"],
-                "created_at": row["created_at"].isoformat() if row["created_at"] else None
-            }
-            for row in rows
-        ]
+        # Columns map 1:1 onto the response keys; timestamps are already
+        # formatted exactly like datetime.isoformat()
+        return [dict(row) for row in rows]
 
 
 async def create_staff_user(email: str, password_hash: str, role: str) -> Dict[str, Any]:
@@ -1311,30 +1595,29 @@ async def create_staff_user(email: str, password_hash: str, role: str) -> Dict[s
         raise ValueError(f"Invalid staff role: {role}")
 
     user_id = str(uuid.uuid4())
+    email = email.lower()
 
     async with get_connection() as conn:
-        # Check if email already exists
-        existing = await conn.fetchrow(
-            "SELECT id FROM users WHERE email = $1",
-            email.lower()
-        )
-        if existing:
-            raise ValueError("Email already registered")
-
-        await conn.execute(
+        # The unique email indexes reject duplicates (in any letter case)
+        # atomically
+        inserted_id = await conn.fetchval(
             """
             INSERT INTO users (id, email, password_hash, auth_provider, role, credits, email_verified, created_at)
             VALUES ($1, $2, $3, 'email', $4, 9999999, TRUE, NOW())
+            ON CONFLICT DO NOTHING
+            RETURNING id
             """,
             user_id,
-            email.lower(),
+            email,
             password_hash,
             role
         )
+        if inserted_id is None:
+            raise ValueError("Email already registered")
 
         return {
             "id": user_id,
-            "email": email.lower(),
+            "email": email,
             "role": role,
             "credits": 9999999,
             "email_verified": True
@@ -1363,8 +1646,6 @@ async def log_admin_action(
     Returns:
         Audit log entry ID
     """
-    import json
-
     async with get_connection() as conn:
         row = await conn.fetchrow(
             """
@@ -1376,65 +1657,104 @@ async def log_admin_action(
             admin_email,
             action,
             target_user_id,
-            json.dumps(details) if details else None
+            details or None
         )
         return str(row["id"])
 
 
+async def log_admin_actions(entries: List[Dict[str, Any]]) -> None:
+    """
+    Log several admin actions to the audit log in one batch.
+
+    Use this instead of calling log_admin_action in a loop for bulk
+    operations; the inserts are pipelined instead of costing a round trip
+    each.
+
+    Args:
+        entries: Dicts with the log_admin_action arguments: admin_id,
+            admin_email and action, plus optional target_user_id and details
+    """
+    if not entries:
+        return
+
+    async with get_connection() as conn:
+        await conn.executemany(
+            """
+            INSERT INTO admin_audit_log (admin_id, admin_email, action, target_user_id, details, created_at)
+            VALUES ($1, $2, $3, $4, $5, NOW())
+            """,
+            [
+                (
+                    entry["admin_id"],
+                    entry["admin_email"],
+                    entry["action"],
+                    entry.get("target_user_id"),
+                    entry.get("details") or None
+                )
+                for entry in entries
+            ]
+        )
+
+
 async def get_audit_log(limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
     """
     Get audit log entries.
 
     Args:
-        limit: Maximum entries to return
+        limit: Maximum entries to return (clamped to 1-500)
         offset: Offset for pagination
 
     Returns:
         List of audit log entries
     """
+    # Bound the page so a large limit can't load the whole log into memory
+    limit = min(max(1, limit), 500)
+    offset = max(0, offset)
+
     async with get_connection() as conn:
         rows = await conn.fetch(
             """
-            SELECT id, admin_id, admin_email, action, target_user_id, details, created_at
+            SELECT id::text as id, admin_id, admin_email, action, target_user_id,
+                   details,
+                   CASE WHEN date_trunc('second', created_at) = created_at
+                        THEN to_char(created_at, 'YYYY-MM-DD"T"HH24:MI:SS')
+                        ELSE to_char(created_at, 'YYYY-MM-DD"T"HH24:MI:SS.US')
+                   END as created_at
             FROM admin_audit_log
-            ORDER BY created_at DESC
+            ORDER BY admin_audit_log.created_at DESC
             LIMIT $1 OFFSET $2
             """,
             limit,
             offset
         )
-        return [
-            {
-                "id": str(row["id"]),
-                "admin_id": row["admin_id"],
-                "admin_email": row["admin_email"],
-                "action": row["action"],
-                "target_user_id": row["target_user_id"],
-                "details": row["details"],
-                "created_at": row["created_at"].isoformat() if row["created_at"] else None
-            }
-            for row in rows
-        ]
+        # Columns map 1:1 onto the response keys; timestamps are already
+        # formatted exactly like datetime.isoformat()
+        return [dict(row) for row in rows]
 
 
 # ============== Follow-up Context Functions ==============
 
-async def save_context_summary(message_id: int, context_summary: Dict[str, Any]):
+async def save_context_summary(
+    message_id: int,
+    context_summary: Dict[str, Any],
+    conn: Optional[asyncpg.Connection] = None
+):
     """
     Save context summary for a message for use in follow-ups.
 
     Args:
         message_id: The assistant message ID
         context_summary: The context summary dict from build_context_summary()
+        conn: Optional connection to reuse instead of acquiring one
     """
-    async with get_connection() as conn:
+    async with get_connection(conn) as conn:
         result = await conn.execute(
             """
             UPDATE messages
             SET context_summary = $1
             WHERE id = $2
             """,
-            json.dumps(context_summary),
+            context_summary,
             message_id
         )
         logger.debug("save_context_summary",
@@ -1454,40 +1774,58 @@ async def get_conversation_context(conversation_id: str) -> Optional[Dict[str, A
         Context summary dict or None if no previous context exists
     """
     async with get_connection() as conn:
-        # First, check if there are any assistant messages with stage3 complete
-        debug_row = await conn.fetchrow(
-            """
-            SELECT id, stage3 IS NOT NULL as has_stage3, context_summary IS NOT NULL as has_context
-            FROM messages
-            WHERE conversation_id = $1
-              AND role = 'assistant'
-            ORDER BY created_at DESC
-            LIMIT 1
-            """,
-            UUID(conversation_id)
-        )
-        logger.debug("get_conversation_context_debug",
-            conversation_id=conversation_id,
-            has_assistant_msg=debug_row is not None,
-            has_stage3=debug_row["has_stage3"] if debug_row else None,
-            has_context=debug_row["has_context"] if debug_row else None)
-
-        row = await conn.fetchrow(
-            """
-            SELECT context_summary
-            FROM messages
-            WHERE conversation_id = $1
-              AND role = 'assistant'
-              AND stage3 IS NOT NULL
-              AND context_summary IS NOT NULL
-            ORDER BY created_at DESC
-            LIMIT 1
-            """,
-            UUID(conversation_id)
-        )
+        if logger.isEnabledFor(logging.DEBUG):
+            # Also report the state of the latest assistant message, in the
+            # same round trip
+            row = await conn.fetchrow(
+                """
+                WITH latest AS (
+                    SELECT stage3 IS NOT NULL as has_stage3,
+                           context_summary IS NOT NULL as has_context
+                    FROM messages
+                    WHERE conversation_id = $1
+                      AND role = 'assistant'
+                    ORDER BY created_at DESC
+                    LIMIT 1
+                )
+                SELECT EXISTS (SELECT 1 FROM latest) as has_assistant_msg,
+                       (SELECT has_stage3 FROM latest) as has_stage3,
+                       (SELECT has_context FROM latest) as has_context,
+                       (
+                           SELECT context_summary
+                           FROM messages
+                           WHERE conversation_id = $1
+                             AND role = 'assistant'
+                             AND stage3 IS NOT NULL
+                             AND context_summary IS NOT NULL
+                           ORDER BY created_at DESC
+                           LIMIT 1
+                       ) as context_summary
+                """,
+                conversation_id
+            )
+            logger.debug("get_conversation_context_debug",
+                conversation_id=conversation_id,
+                has_assistant_msg=row["has_assistant_msg"],
+                has_stage3=row["has_stage3"],
+                has_context=row["has_context"])
+        else:
+            row = await conn.fetchrow(
+                """
+                SELECT context_summary
+                FROM messages
+                WHERE conversation_id = $1
+                  AND role = 'assistant'
+                  AND stage3 IS NOT NULL
+                  AND context_summary IS NOT NULL
+                ORDER BY created_at DESC
+                LIMIT 1
+                """,
+                conversation_id
+            )
 
         if row and row["context_summary"]:
-            context = parse_json_field(row["context_summary"])
+            context = row["context_summary"]
             logger.info("get_conversation_context_found",
                 conversation_id=conversation_id,
                 context_keys=list(context.keys()) if context else [])
@@ -1511,10 +1849,22 @@ async def get_last_stage3_response(conversation_id: str) -> Optional[str]:
     Returns:
         The stage3 response text, or None if no completed decision exists
     """
+    cache_key = ("conversation", _conversation_key(conversation_id))
+    cached = _stage3_response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    generation = _conversation_generation
     async with get_connection() as conn:
+        # stage3 is stored as {"model": "...", "response": "..."}; extract the
+        # response server-side instead of shipping and decoding the whole
+        # payload
         row = await conn.fetchrow(
             """
-            SELECT stage3
+            SELECT CASE WHEN jsonb_typeof(stage3) = 'object'
+                        THEN COALESCE(stage3->>'response', '')
+                        ELSE stage3 #>> '{}'
+                   END as response
             FROM messages
             WHERE conversation_id = $1
               AND role = 'assistant'
@@ -1522,16 +1872,14 @@ async def get_last_stage3_response(conversation_id: str) -> Optional[str]:
             ORDER BY created_at DESC
             LIMIT 1
             """,
-            UUID(conversation_id)
+            conversation_id
         )
 
-        if row and row["stage3"]:
-            stage3_data = parse_json_field(row["stage3"])
-            # stage3 is stored as {"model": "...", "response": "..."}
-            if isinstance(stage3_data, dict):
-                return stage3_data.get("response", "")
-            return str(stage3_data)
+    if row is None or row["response"] is None:
         return None
+    if generation == _conversation_generation:
+        _stage3_response_cache.set(cache_key, row["response"])
+    return row["response"]
 
 
 async def get_stage3_by_message_id(message_id: int) -> Optional[str]:
@@ -1547,10 +1895,20 @@ async def get_stage3_by_message_id(message_id: int) -> Optional[str]:
     Returns:
         The stage3 response text, or None if not found or not completed
     """
+    cache_key = ("message", message_id)
+    cached = _stage3_response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    generation = _conversation_generation
     async with get_connection() as conn:
+        # Extract the response server-side, as in get_last_stage3_response
         row = await conn.fetchrow(
             """
-            SELECT stage3
+            SELECT CASE WHEN jsonb_typeof(stage3) = 'object'
+                        THEN COALESCE(stage3->>'response', '')
+                        ELSE stage3 #>> '{}'
+                   END as response
             FROM messages
             WHERE id = $1
               AND role = 'assistant'
@@ -1559,13 +1917,11 @@ async def get_stage3_by_message_id(message_id: int) -> Optional[str]:
             message_id
         )
 
-        if row and row["stage3"]:
-            stage3_data = parse_json_field(row["stage3"])
-            # stage3 is stored as {"model": "...", "response": "..."}
-            if isinstance(stage3_data, dict):
-                return stage3_data.get("response", "")
-            return str(stage3_data)
+    if row is None or row["response"] is None:
         return None
+    if generation == _conversation_generation:
+        _stage3_response_cache.set(cache_key, row["response"])
+    return row["response"]
 
 
 async def get_conversation_message_count(conversation_id: str) -> int:
@@ -1580,15 +1936,12 @@ async def get_conversation_message_count(conversation_id: str) -> int:
         Number of user messages in the conversation
     """
     async with get_connection() as conn:
-        row = await conn.fetchrow(
-            """
-            SELECT COUNT(*) as count
-            FROM messages
-            WHERE conversation_id = $1 AND role = 'user'
-            """,
-            UUID(conversation_id)
+        # Maintained by the messages trigger; no scan of the messages table
+        count = await conn.fetchval(
+            "SELECT message_count FROM conversations WHERE id = $1",
+            conversation_id
         )
-        return row["count"] if row else 0
+        return count or 0
 
 
 async def get_message_by_id(conversation_id: str, message_id: int) -> Optional[Dict[str, Any]]:
@@ -1609,7 +1962,7 @@ async def get_message_by_id(conversation_id: str, message_id: int) -> Optional[D
             FROM messages
             WHERE id = $1 AND conversation_id = $2
             """,
-            message_id, UUID(conversation_id)
+            message_id, conversation_id
         )
 
         if not row:
@@ -1619,11 +1972,11 @@ async def get_message_by_id(conversation_id: str, message_id: int) -> Optional[D
             "id": row["id"],
             "role": row["role"],
             "content": row["content"],
-            "stage1": parse_json_field(row["stage1"]) if row["stage1"] else None,
-            "stage1_5": parse_json_field(row["stage1_5"]) if row["stage1_5"] else None,
-            "stage2": parse_json_field(row["stage2"]) if row["stage2"] else None,
-            "stage3": parse_json_field(row["stage3"]) if row["stage3"] else None,
-            "metadata": parse_json_field(row["metadata"]) if row["metadata"] else {},
+            "stage1": row["stage1"] or None,
+            "stage1_5": row["stage1_5"] or None,
+            "stage2": row["stage2"] or None,
+            "stage3": row["stage3"] or None,
+            "metadata": row["metadata"] or {},
             "created_at": row["created_at"].isoformat() if row["created_at"] else None
         }
 
@@ -1652,7 +2005,7 @@ async def delete_user_message(conversation_id: str, message_id: int) -> bool:
             SELECT id, role FROM messages
             WHERE id = $1 AND conversation_id = $2
             """,
-            message_id, UUID(conversation_id)
+            message_id, conversation_id
         )
 
         if not row:
@@ -1667,10 +2020,11 @@ async def delete_user_message(conversation_id: str, message_id: int) -> bool:
             DELETE FROM messages
             WHERE id = $1 AND conversation_id = $2 AND role = 'user'
             """,
-            message_id, UUID(conversation_id)
+            message_id, conversation_id
         )
 
-        return True
+    invalidate_conversation_cache(conversation_id, messages_deleted=True)
+    return True
 
 
 # ============== Magic Link Token Functions ==============
@@ -1721,15 +2075,17 @@ async def verify_magic_link_token(token: str) -> Optional[Dict[str, Any]]:
     Returns:
         Token data dict if valid, None if expired/used/not found
     """
-    from datetime import datetime
-
     async with get_connection() as conn:
-        # Find the token
+        # Check and consume in one statement so a token can't be redeemed
+        # twice by concurrent requests
         row = await conn.fetchrow(
             """
-            SELECT id, email, user_id, token_type, expires_at, used_at
-            FROM magic_link_tokens
+            UPDATE magic_link_tokens
+            SET used_at = NOW()
             WHERE token = $1
+              AND used_at IS NULL
+              AND expires_at > NOW()
+            RETURNING email, user_id, token_type
             """,
             token
         )
@@ -1737,24 +2093,6 @@ async def verify_magic_link_token(token: str) -> Optional[Dict[str, Any]]:
         if not row:
             return None
 
-        # Check if already used
-        if row["used_at"] is not None:
-            return None
-
-        # Check if expired
-        if row["expires_at"] < datetime.utcnow():
-            return None
-
-        # Mark as used
-        await conn.execute(
-            """
-            UPDATE magic_link_tokens
-            SET used_at = NOW()
-            WHERE id = $1
-            """,
-            row["id"]
-        )
-
         return {
             "email": row["email"],
             "user_id": row["user_id"],
@@ -1808,24 +2146,20 @@ async def mark_email_verified(user_id: str, grant_credits: bool = True) -> bool:
         True if successful
     """
     async with get_connection() as conn:
-        if grant_credits:
-            await conn.execute(
-                """
-                UPDATE users
-                SET email_verified = TRUE, credits = credits + 5
-                WHERE id = $1 AND email_verified = FALSE
-                """,
-                user_id
-            )
-        else:
-            await conn.execute(
-                """
-                UPDATE users
-                SET email_verified = TRUE
-                WHERE id = $1
-                """,
-                user_id
-            )
+        # Credits are granted only on the first verification; already
+        # verified users are left untouched
+        await conn.execute(
+            """
+            UPDATE users
+            SET email_verified = TRUE,
+                credits = credits + CASE WHEN $2::boolean AND email_verified = FALSE
+                                         THEN 5 ELSE 0 END
+            WHERE id = $1 AND email_verified IS DISTINCT FROM TRUE
+            """,
+            user_id,
+            grant_credits
+        )
+    invalidate_user_cache(user_id)
     return True
 
 
@@ -1901,6 +2235,60 @@ MODE_TO_QUOTA_FIELD = {
 }
 
 
+def _build_quota_sql(quota_field: str) -> Dict[str, str]:
+    """Build the per-mode quota statements for a quota field."""
+    admin_col = f"{quota_field.replace('_decision', '')}_decisions"
+    quota_col = f"{quota_field}_quota"
+    used_col = f"{quota_field}_used"
+    return {
+        "select_admin_grant": f"""
+            SELECT id, {admin_col} as remaining
+            FROM admin_granted_decisions
+            WHERE user_id = $1
+              AND {admin_col} > 0
+              AND (expires_at IS NULL OR expires_at > NOW())
+            ORDER BY
+              CASE WHEN expires_at IS NULL THEN 1 ELSE 0 END,
+              expires_at ASC,
+              created_at ASC
+            LIMIT 1
+            FOR UPDATE
+            """,
+        "deduct_admin_grant": f"""
+                UPDATE admin_granted_decisions
+                SET {admin_col} = {admin_col} - 1
+                WHERE id = $1
+                """,
+        "reserve_subscription": f"""
+            UPDATE user_quotas
+            SET {used_col} = {used_col} + 1,
+                updated_at = NOW()
+            WHERE user_id = $1
+              AND {quota_col} > {used_col}
+            RETURNING {quota_col} as quota, {used_col} as used
+            """,
+        "refund_subscription": f"""
+            UPDATE user_quotas
+            SET {used_col} = GREATEST(0, {used_col} - 1),
+                updated_at = NOW()
+            WHERE user_id = $1
+            """,
+        "grant_admin_decisions": f"""
+            INSERT INTO admin_granted_decisions
+                (id, user_id, {admin_col}, granted_by, granted_by_email, notes, expires_at, granted_at)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, NOW())
+            """,
+    }
+
+
+# Quota statements built once at import so each request reuses the same
+# SQL text (and asyncpg's cached prepared statement) instead of re-formatting it
+QUOTA_SQL = {
+    field: _build_quota_sql(field)
+    for field in set(MODE_TO_QUOTA_FIELD.values())
+}
+
+
 class InsufficientQuotaError(Exception):
     """Raised when a user doesn't have enough quota for an operation."""
     def __init__(self, mode: str, available: int):
@@ -1909,15 +2297,19 @@ class InsufficientQuotaError(Exception):
         super().__init__(f"No {mode} decisions remaining (have {available})")
 
 
-async def ensure_user_quotas(user_id: str) -> None:
+async def ensure_user_quotas(
+    user_id: str,
+    conn: Optional[asyncpg.Connection] = None
+) -> None:
     """
     Ensure a user has a quota record. Creates one if it doesn't exist.
 
     Args:
         user_id: User ID
+        conn: Optional connection to reuse instead of acquiring one
     """
     import uuid
-    async with get_connection() as conn:
+    async with get_connection(conn) as conn:
         existing = await conn.fetchval(
             "SELECT id FROM user_quotas WHERE user_id = $1",
             user_id
@@ -1934,7 +2326,10 @@ async def ensure_user_quotas(user_id: str) -> None:
             )
 
 
-async def get_user_quotas(user_id: str) -> Dict[str, Any]:
+async def get_user_quotas(
+    user_id: str,
+    conn: Optional[asyncpg.Connection] = None
+) -> Dict[str, Any]:
     """
     Get a user's quota status including subscription quotas and admin grants.
 
@@ -1944,6 +2339,7 @@ async def get_user_quotas(user_id: str) -> Dict[str, Any]:
 
     Args:
         user_id: User ID
+        conn: Optional connection to reuse instead of acquiring one
 
     Returns:
         Dict with quota information per decision type:
@@ -1954,9 +2350,9 @@ async def get_user_quotas(user_id: str) -> Dict[str, Any]:
             "quota_period_end": "2026-02-01T00:00:00Z"
         }
     """
-    await ensure_user_quotas(user_id)
+    await ensure_user_quotas(user_id, conn=conn)
 
-    async with get_connection() as conn:
+    async with get_connection(conn) as conn:
         # Get subscription quotas
         quota_row = await conn.fetchrow(
             """
@@ -2051,59 +2447,24 @@ async def reserve_decision_quota(user_id: str, mode: str) -> Dict[str, Any]:
     if not quota_field:
         raise ValueError(f"Unknown mode: {mode}")
 
-    # Column names for this mode
-    admin_col = f"{quota_field.replace('_decision', '')}_decisions"
-    quota_col = f"{quota_field}_quota"
-    used_col = f"{quota_field}_used"
+    sql = QUOTA_SQL[quota_field]
 
     await ensure_user_quotas(user_id)
 
     async with get_connection() as conn:
         # Try to deduct from admin grants first (oldest/expiring soonest first)
         # Check for grants with remaining decisions
-        admin_grant = await conn.fetchrow(
-            f"""
-            SELECT id, {admin_col} as remaining
-            FROM admin_granted_decisions
-            WHERE user_id = $1
-              AND {admin_col} > 0
-              AND (expires_at IS NULL OR expires_at > NOW())
-            ORDER BY
-              CASE WHEN expires_at IS NULL THEN 1 ELSE 0 END,
-              expires_at ASC,
-              created_at ASC
-            LIMIT 1
-            FOR UPDATE
-            """,
-            user_id
-        )
+        admin_grant = await conn.fetchrow(sql["select_admin_grant"], user_id)
 
         if admin_grant and admin_grant["remaining"] > 0:
             # Deduct from admin grant
-            await conn.execute(
-                f"""
-                UPDATE admin_granted_decisions
-                SET {admin_col} = {admin_col} - 1
-                WHERE id = $1
-                """,
-                admin_grant["id"]
-            )
+            await conn.execute(sql["deduct_admin_grant"], admin_grant["id"])
             logger.info("quota_reserved_from_admin_grant",
                        user_id=user_id, mode=mode, grant_id=admin_grant["id"])
             return await get_user_quotas(user_id)
 
         # Try to deduct from subscription quota
-        result = await conn.fetchrow(
-            f"""
-            UPDATE user_quotas
-            SET {used_col} = {used_col} + 1,
-                updated_at = NOW()
-            WHERE user_id = $1
-              AND {quota_col} > {used_col}
-            RETURNING {quota_col} as quota, {used_col} as used
-            """,
-            user_id
-        )
+        result = await conn.fetchrow(sql["reserve_subscription"], user_id)
 
         if result:
             logger.info("quota_reserved_from_subscription",
@@ -2135,18 +2496,8 @@ async def refund_decision_quota(user_id: str, mode: str) -> Dict[str, Any]:
     if not quota_field:
         raise ValueError(f"Unknown mode: {mode}")
 
-    used_col = f"{quota_field}_used"
-
     async with get_connection() as conn:
-        await conn.execute(
-            f"""
-            UPDATE user_quotas
-            SET {used_col} = GREATEST(0, {used_col} - 1),
-                updated_at = NOW()
-            WHERE user_id = $1
-            """,
-            user_id
-        )
+        await conn.execute(QUOTA_SQL[quota_field]["refund_subscription"], user_id)
 
     logger.info("quota_refunded", user_id=user_id, mode=mode)
     return await get_user_quotas(user_id)
@@ -2325,23 +2676,11 @@ async def grant_admin_decisions(
     if decision_type not in valid_types:
         raise ValueError(f"Invalid decision_type: {decision_type}. Must be one of {valid_types}")
 
-    # Map to column name
-    col_map = {
-        "quick_decision": "quick_decisions",
-        "standard_decision": "standard_decisions",
-        "premium_decision": "premium_decisions",
-    }
-    col = col_map[decision_type]
-
     grant_id = str(uuid.uuid4())
 
     async with get_connection() as conn:
         await conn.execute(
-            f"""
-            INSERT INTO admin_granted_decisions
-                (id, user_id, {col}, granted_by, granted_by_email, notes, expires_at, granted_at)
-            VALUES ($1, $2, $3, $4, $5, $6, $7, NOW())
-            """,
+            QUOTA_SQL[decision_type]["grant_admin_decisions"],
             grant_id,
             user_id,
             amount,